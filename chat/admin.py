@@ -1,14 +1,49 @@
 from django.contrib import admin
-from .models import Message, UserStatus
+from . import search
+from .models import ArchivedMessage, BotReplyJob, CachedBotReply, Conversation, Message, UserStatus
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
-    list_display = ('sender', 'receiver', 'content', 'timestamp', 'is_read', 'is_bot_response')
-    list_filter = ('is_read', 'is_bot_response', 'timestamp')
-    search_fields = ('content', 'sender__username', 'receiver__username')
+    list_display = ('sender', 'receiver', 'content', 'timestamp', 'is_bot_response')
+    list_filter = ('is_bot_response', 'timestamp')
+    search_fields = ('sender__username', 'receiver__username')
+    date_hierarchy = 'timestamp'
+
+    def get_search_results(self, request, queryset, search_term):
+        # Content goes through the full-text index instead of LIKE '%term%'
+        by_user, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        content_match = search.matches(search_term)
+        if content_match is None:
+            return by_user, may_have_duplicates
+        return by_user | queryset.filter(content_match), may_have_duplicates
+
+@admin.register(ArchivedMessage)
+class ArchivedMessageAdmin(admin.ModelAdmin):
+    list_display = ('sender', 'receiver', 'content', 'timestamp', 'archived_at')
+    list_filter = ('is_bot_response',)
+    raw_id_fields = ('sender', 'receiver')
     date_hierarchy = 'timestamp'
 
 @admin.register(UserStatus)
 class UserStatusAdmin(admin.ModelAdmin):
     list_display = ('user', 'is_online', 'last_online')
     list_filter = ('is_online',)
+
+
+@admin.register(BotReplyJob)
+class BotReplyJobAdmin(admin.ModelAdmin):
+    list_display = ('message', 'status', 'attempts', 'run_after', 'created_at')
+    list_filter = ('status',)
+    raw_id_fields = ('message', 'reply')
+
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_display = ('user_a', 'user_b', 'last_message_preview', 'last_message_at', 'last_read_a', 'last_read_b', 'unread_a', 'unread_b')
+    raw_id_fields = ('user_a', 'user_b', 'last_message')
+
+
+@admin.register(CachedBotReply)
+class CachedBotReplyAdmin(admin.ModelAdmin):
+    list_display = ('prompt', 'reply', 'model_name', 'created_at')
+    search_fields = ('prompt',)
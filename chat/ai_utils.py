@@ -1,68 +1,238 @@
-import os
-import sys
-from .models import Message
-from django.db import models
+import gc
+import importlib
+import importlib.util
+import logging
+import threading
+from . import metrics
 from django.conf import settings
+from django.utils.module_loading import import_string
 
-# Import transformers
-try:
-    from transformers import BlenderbotTokenizer, BlenderbotForConditionalGeneration
-    import torch
-    TRANSFORMERS_AVAILABLE = True
-except ImportError:
-    TRANSFORMERS_AVAILABLE = False
-    print("ERROR: Transformers library is not available")
+logger = logging.getLogger(__name__)
 
-def create_bot_response(sender, receiver):
+
+class LazyModule:
+    """
+    Stands in for a heavy library until it is used: the first attribute
+    access imports the real module. `available` tells whether it is
+    installed without importing it.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    @property
+    def available(self):
+        return importlib.util.find_spec(self._name) is not None
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# Importing these takes seconds and hundreds of MB, so it waits for the
+# first model load instead of happening in every process that loads the URLconf
+torch = LazyModule('torch')
+transformers = LazyModule('transformers')
+
+TRANSFORMERS_AVAILABLE = torch.available and transformers.available
+
+DEFAULT_MODEL_NAME = "facebook/blenderbot-400M-distill"
+
+
+def _model_config():
+    """
+    Read the settings that decide which model is loaded and how,
+    falling back to the defaults
+    """
+    return (
+        getattr(settings, 'AI_BOT_BACKEND', 'chat.ai_utils.TorchBackend'),
+        getattr(settings, 'AI_BOT_MODEL_NAME', DEFAULT_MODEL_NAME),
+        getattr(settings, 'AI_BOT_DEVICE', 'cpu'),
+        getattr(settings, 'AI_BOT_NUM_THREADS', 0),
+        getattr(settings, 'AI_BOT_INTEROP_THREADS', 0),
+        getattr(settings, 'AI_BOT_DTYPE', 'float32'),
+    )
+
+
+def _generation_config():
+    return {
+        'num_beams': getattr(settings, 'AI_BOT_NUM_BEAMS', 1),
+        'max_new_tokens': getattr(settings, 'AI_BOT_MAX_NEW_TOKENS', 60),
+    }
+
+
+class TorchBackend:
+    """
+    Runs BlenderBot with PyTorch on AI_BOT_DEVICE, with weights in AI_BOT_DTYPE.
+
+    Backends are chosen with the AI_BOT_BACKEND setting; subclasses change
+    how the loaded model is prepared or how replies are generated.
+    """
+
+    def __init__(self, model_name, device, dtype):
+        self.model_name = model_name
+        self.device = device
+        self.dtype = dtype
+        self.tokenizer = None
+        self.model = None
+
+    def load(self):
+        self.tokenizer = transformers.BlenderbotTokenizer.from_pretrained(self.model_name)
+        model = transformers.BlenderbotForConditionalGeneration.from_pretrained(
+            self.model_name,
+            torch_dtype=getattr(torch, self.dtype),
+        )
+        model.eval()
+        self.model = self.prepare(model)
+
+    def prepare(self, model):
+        return model.to(self.device)
+
+    def generate(self, prompts):
+        """
+        One decoded reply per prompt, from a single padded generate() call
+        """
+        with metrics.timed('tokenize'):
+            inputs = self.tokenizer(prompts, return_tensors="pt", padding=True, truncation=True).to(self.model.device)
+        with metrics.timed('generate'), torch.inference_mode():
+            reply_ids = self.model.generate(**inputs, **_generation_config())
+        with metrics.timed('decode'):
+            return self.tokenizer.batch_decode(reply_ids, skip_special_tokens=True)
+
+    def unload(self):
+        self.tokenizer = None
+        self.model = None
+        gc.collect()
+        if self.device.startswith('cuda'):
+            torch.cuda.empty_cache()
+
+
+class QuantizedCPUBackend(TorchBackend):
+    """
+    Dynamic int8 quantization: the weights of every Linear layer are
+    quantized once after loading and activations on the fly, which cuts
+    memory and speeds up generation on CPUs. Loads in float32, on the CPU.
+    """
+
+    def __init__(self, model_name, device, dtype):
+        if device != 'cpu':
+            raise ValueError('QuantizedCPUBackend only runs on the CPU')
+        super().__init__(model_name, device, 'float32')
+
+    def prepare(self, model):
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _set_threads(num_threads, interop_threads):
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # Only possible before torch starts any parallel work
+            logger.warning("Could not set %s inter-op threads; torch is already running", interop_threads)
+
+
+class ModelRegistry:
+    """
+    Process-wide holder for the inference backend and its loaded model.
+
+    The model is loaded lazily on first use and shared by every request
+    handled by this process. If the model settings change, the next call
+    to get() loads the new model in place of the old one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._config = None
+        self._backend = None
+
+    @property
+    def is_loaded(self):
+        return self._backend is not None
+
+    def get(self):
+        """
+        Return the loaded backend, loading it if needed
+        """
+        config = _model_config()
+        if self._backend is not None and self._config == config:
+            return self._backend
+
+        with self._lock:
+            if self._backend is None or self._config != config:
+                self._unload()
+                self._load(config)
+            return self._backend
+
+    def warm(self):
+        """
+        Load the model ahead of the first request. Errors are logged, not raised,
+        so a missing model never prevents the process from starting.
+        """
+        if not TRANSFORMERS_AVAILABLE:
+            logger.error("Cannot preload the AI bot model: transformers or torch is not installed")
+            return False
+        try:
+            self.get()
+        except Exception:
+            logger.exception("Could not preload the AI bot model")
+            return False
+        return True
+
+    def evict(self):
+        """
+        Drop the loaded model and free its memory
+        """
+        with self._lock:
+            self._unload()
+
+    def reload(self):
+        """
+        Drop the loaded model and load it again from the current settings
+        """
+        self.evict()
+        return self.get()
+
+    def _load(self, config):
+        backend_path, model_name, device, num_threads, interop_threads, dtype = config
+        _set_threads(num_threads, interop_threads)
+
+        logger.info("Loading AI bot model %s with %s on %s (%s)", model_name, backend_path, device, dtype)
+        backend = import_string(backend_path)(model_name, device, dtype)
+        backend.load()
+
+        self._backend = backend
+        self._config = config
+
+    def _unload(self):
+        if self._backend is None:
+            return
+        self._backend.unload()
+        self._backend = None
+        self._config = None
+
+
+registry = ModelRegistry()
+
+
+def generate_replies(prompts):
     """
-    Create a bot response using BlenderBot if AI bot is enabled
+    Generate BlenderBot replies for a batch of prompts with a single
+    padded generate() call. Returns one reply per prompt, or None where the
+    model produced nothing usable; errors are raised.
     """
-    if not TRANSFORMERS_AVAILABLE:
-        return None
-    
-    # Check if the receiver has AI bot enabled
-    try:
-        if not receiver.userstatus.ai_bot_enabled:
-            return None
-    except Exception:
-        return None
-
-        
-    
-    # Get the last message from sender to receiver
-    last_message = Message.objects.filter(
-        sender=sender,
-        receiver=receiver
-    ).order_by('-timestamp').first()
-    
-    # If no message found, don't respose
-
-    if not last_message:
-        return None
-    
-    try:
-
-        # Load BlenderBot model
-        model_name = "facebook/blenderbot-400M-distill"
-        tokenizer = BlenderbotTokenizer.from_pretrained(model_name)
-        model = BlenderbotForConditionalGeneration.from_pretrained(model_name)
-        
-        # Generate response
-        inputs = tokenizer([last_message.content], return_tensors="pt")
-        reply_ids = model.generate(**inputs, max_length=100)
-        response = tokenizer.batch_decode(reply_ids, skip_special_tokens=True)[0]
-        
-        # If response is valid, create a message
-        if response and len(response.strip()) > 2:
-            bot_message = Message(
-                sender=receiver,
-                receiver=sender,
-                content=response,
-                is_bot_response=True
-            )
-            bot_message.save()
-            return bot_message
-    except Exception:
-        pass
-        
-    return None 
\ No newline at end of file
+    responses = registry.get().generate(prompts)
+    metrics.increment('chat_bot_replies_generated_total', len(prompts))
+
+    return [
+        response if response and len(response.strip()) > 2 else None
+        for response in responses
+    ]
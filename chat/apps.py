@@ -1,4 +1,7 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class ChatConfig(AppConfig):
@@ -7,3 +10,12 @@ class ChatConfig(AppConfig):
     
     def ready(self):
         import chat.signals
+        from . import metrics, search
+
+        # Count and time the queries of every connection for the metrics
+        connection_created.connect(metrics.install)
+        post_migrate.connect(search.restore_triggers, sender=self)
+
+        if getattr(settings, 'AI_BOT_PRELOAD', False):
+            from .ai_utils import registry
+            registry.warm()
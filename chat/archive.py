@@ -0,0 +1,45 @@
+"""
+Retention for the Message table.
+
+Messages older than the retention horizon are moved to ArchivedMessage by
+the `archive_messages` command, a small batch at a time, each batch in its
+own short transaction, so the hot table only holds recent history and the
+SQLite writer lock is never held for long. Archived messages keep their
+ids, and the history API reads them once a conversation's live messages
+run out.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedMessage, Message
+
+ARCHIVED_FIELDS = ['id', 'sender_id', 'receiver_id', 'content', 'is_bot_response', 'timestamp']
+
+
+def cutoff(days):
+    return timezone.now() - timedelta(days=days)
+
+
+def archive_batch(before, batch_size):
+    """
+    Move up to `batch_size` of the oldest messages sent before `before` to
+    the archive. Returns the number of messages moved.
+    """
+    with transaction.atomic():
+        # Old messages have the lowest ids, so walking the primary key
+        # finds a batch without an index on timestamp
+        rows = list(
+            Message.objects.filter(timestamp__lt=before).order_by('id').values(*ARCHIVED_FIELDS)[:batch_size]
+        )
+        if not rows:
+            return 0
+        archived_at = timezone.now()
+        ArchivedMessage.objects.bulk_create(
+            [ArchivedMessage(archived_at=archived_at, **row) for row in rows],
+            ignore_conflicts=True,
+        )
+        # Also drops their finished bot jobs and clears Conversation.last_message
+        Message.objects.filter(id__in=[row['id'] for row in rows]).delete()
+    return len(rows)
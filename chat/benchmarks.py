@@ -0,0 +1,75 @@
+"""
+Helpers shared by the benchmark, load-test and query-check management
+commands.
+"""
+import os
+import re
+import sys
+
+from . import search
+from .models import Message
+
+# Typical chat messages, used as model inputs by the AI bot benchmarks
+SAMPLE_PROMPTS = [
+    "hi",
+    "are you there?",
+    "What are you doing this weekend?",
+    "Can you call me back when you get this?",
+    "ok",
+    "I just finished reading a great book about space travel.",
+    "Did you see the game last night?",
+    "Where should we go for dinner?",
+]
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def rss_mb():
+    # Current resident set size, from /proc where available
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return 0.0
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def hot_queries(user_id, other_id):
+    """
+    The Message queries run on every page load, poll or read flush, keyed
+    by name. UPDATEs are checked through the SELECT with the same filter.
+    """
+    conversation = Message.objects.between(user_id, other_id)
+    return {
+        'conversation page': conversation.order_by('-timestamp', '-id')[:51],
+        'conversation delta': conversation.filter(id__gt=0).order_by('id')[:51],
+        # Unread counters are recomputed from the read watermark
+        'unread messages': Message.objects.filter(sender=other_id, receiver=user_id, id__gt=0).order_by(),
+        'last message': Message.objects.filter(sender=user_id, receiver=other_id).order_by('-timestamp')[:1],
+        # Admin search by content, answered by the full-text index
+        'content search': Message.objects.filter(search.matches('hello')).order_by('-timestamp'),
+    }
+
+
+def full_scans(plan, table):
+    """
+    Plan lines that read the whole table instead of searching an index
+    """
+    # Not a scan of the table's full-text index, which is a search
+    return [line for line in plan.splitlines() if re.search(rf'SCAN {table}\b', line)]
@@ -0,0 +1,228 @@
+"""
+Database-backed queue for AI bot replies.
+
+send_message only enqueues a BotReplyJob; the reply itself is generated by
+the `run_bot_worker` management command, outside the web request.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics, reply_cache
+from .ai_utils import TRANSFORMERS_AVAILABLE, generate_replies
+from .conversations import record_messages
+from .presence import is_recently_seen
+from .models import BotReplyJob, Message, UserStatus
+
+
+def _backlog():
+    # Counting stops at the limit, however deep the queue is
+    limit = settings.BOT_QUEUE_MAX_PENDING
+    return BotReplyJob.objects.filter(status=BotReplyJob.STATUS_PENDING)[:limit], limit
+
+
+def _decided(decision):
+    metrics.increment('chat_bot_reply_decisions_total', decision=decision)
+
+
+def enqueue_bot_reply(message):
+    """
+    Queue a bot reply to the given message. Returns the job, or None when
+    BOT_QUEUE_MAX_PENDING replies are already waiting: the message stays,
+    but the bot does not answer it.
+    """
+    backlog, limit = _backlog()
+    if backlog.count() >= limit:
+        _decided('skipped')
+        return None
+    _decided('queued')
+    return BotReplyJob.objects.create(message=message)
+
+
+async def aenqueue_bot_reply(message):
+    backlog, limit = _backlog()
+    if await backlog.acount() >= limit:
+        _decided('skipped')
+        return None
+    _decided('queued')
+    return await BotReplyJob.objects.acreate(message=message)
+
+
+def _due_jobs():
+    return BotReplyJob.objects.filter(
+        status=BotReplyJob.STATUS_PENDING,
+        run_after__lte=timezone.now(),
+    )
+
+
+def has_due_jobs():
+    return _due_jobs().exists()
+
+
+def claim_jobs(limit):
+    """
+    Claim up to `limit` due jobs for this worker.
+
+    Each job is claimed with a conditional UPDATE, so several workers can
+    poll the same table without running a job twice.
+    """
+    now = timezone.now()
+    candidates = _due_jobs().order_by('run_after', 'id').values_list('id', flat=True)[:limit]
+
+    claimed = []
+    for job_id in list(candidates):
+        updated = BotReplyJob.objects.filter(
+            id=job_id,
+            status=BotReplyJob.STATUS_PENDING,
+        ).update(
+            status=BotReplyJob.STATUS_RUNNING,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+        )
+        if updated:
+            claimed.append(job_id)
+
+    return list(
+        BotReplyJob.objects.filter(id__in=claimed)
+        .select_related('message__sender', 'message__receiver__userstatus')
+        .order_by('run_after', 'id')
+    )
+
+
+def claim_batch(max_size, window):
+    """
+    Claim a batch of up to `max_size` jobs.
+
+    If fewer jobs are due, keep collecting for up to `window` seconds so
+    that replies arriving close together share one generate() call.
+    """
+    jobs = claim_jobs(max_size)
+    if not jobs or len(jobs) >= max_size or window <= 0:
+        return jobs
+
+    deadline = time.monotonic() + window
+    while len(jobs) < max_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(remaining, 0.01))
+        jobs.extend(claim_jobs(max_size - len(jobs)))
+    return jobs
+
+
+def should_reply(job):
+    """
+    The receiver may have come online or turned the bot off since the job was queued
+    """
+    try:
+        status = job.message.receiver.userstatus
+    except UserStatus.DoesNotExist:
+        return False
+    return status.ai_bot_enabled and not is_recently_seen(status)
+
+
+def complete_jobs(jobs, contents):
+    """
+    Store the bot replies for a batch of jobs and mark them done.
+
+    `contents` holds one reply text (or None) per job. Replies are written
+    with a single bulk_create. Jobs that no longer belong to this worker
+    (for instance because they timed out and were handed back to the queue)
+    are skipped. Returns the created reply Messages.
+    """
+    with transaction.atomic():
+        owned = []
+        for job, content in zip(jobs, contents):
+            updated = BotReplyJob.objects.filter(
+                id=job.id,
+                status=BotReplyJob.STATUS_RUNNING,
+                locked_at=job.locked_at,
+            ).update(status=BotReplyJob.STATUS_DONE)
+            if updated and content:
+                owned.append((job, content))
+
+        replies = Message.objects.bulk_create([
+            Message(
+                sender=job.message.receiver,
+                receiver=job.message.sender,
+                content=content,
+                is_bot_response=True,
+            )
+            for job, content in owned
+        ])
+
+        record_messages(replies)
+
+        for (job, content), reply in zip(owned, replies):
+            job.reply = reply
+        BotReplyJob.objects.bulk_update([job for job, content in owned], ['reply'])
+        return replies
+
+
+def run_batch(jobs):
+    """
+    Generate and store the replies for a batch of claimed jobs with at most
+    one model.generate call; cached replies skip the model. Errors are
+    raised to the worker.
+    """
+    contents = [None] * len(jobs)
+    if TRANSFORMERS_AVAILABLE:
+        wanted = [i for i, job in enumerate(jobs) if should_reply(job)]
+        if wanted:
+            replies = reply_cache.generate_cached([jobs[i].message.content for i in wanted], generate_replies)
+            for i, reply in zip(wanted, replies):
+                contents[i] = reply
+    return complete_jobs(jobs, contents)
+
+
+def fail_jobs(jobs, error, max_attempts=None):
+    """
+    Record a failed attempt for every job in a batch
+    """
+    for job in jobs:
+        fail_job(job, error, max_attempts)
+
+
+def fail_job(job, error, max_attempts=None):
+    """
+    Record a failed attempt and either schedule a retry or give up
+    """
+    if max_attempts is None:
+        max_attempts = settings.BOT_WORKER_MAX_ATTEMPTS
+
+    if job.attempts >= max_attempts:
+        status = BotReplyJob.STATUS_FAILED
+        run_after = job.run_after
+    else:
+        status = BotReplyJob.STATUS_PENDING
+        # Exponential backoff: 2s, 4s, 8s, ...
+        run_after = timezone.now() + timedelta(seconds=2 ** job.attempts)
+
+    BotReplyJob.objects.filter(
+        id=job.id,
+        status=BotReplyJob.STATUS_RUNNING,
+        locked_at=job.locked_at,
+    ).update(status=status, run_after=run_after, locked_at=None, last_error=str(error)[:2000])
+
+
+def requeue_stale_jobs(timeout, max_attempts=None):
+    """
+    Hand back jobs left running by a worker that died mid-job
+    """
+    if max_attempts is None:
+        max_attempts = settings.BOT_WORKER_MAX_ATTEMPTS
+
+    stale = BotReplyJob.objects.filter(
+        status=BotReplyJob.STATUS_RUNNING,
+        locked_at__lt=timezone.now() - timedelta(seconds=timeout * 2),
+    )
+    stale.filter(attempts__gte=max_attempts).update(
+        status=BotReplyJob.STATUS_FAILED,
+        locked_at=None,
+        last_error='Worker stopped while running the job',
+    )
+    return stale.update(status=BotReplyJob.STATUS_PENDING, locked_at=None)
@@ -0,0 +1,300 @@
+"""
+Cached reads for the user list: the user directory, each user's
+conversation summaries and presence snapshots.
+
+Every cached value is stored under a version. Writes never update a cached
+value; they change its version, so a reader that raced with a write can
+only ever store its result under a version nobody reads any more. The
+versions double as cheap version tags for the data, which the JSON
+endpoints use as ETags.
+
+Conversation summaries and the user directory are versioned by the
+database rows they are built from (see conversations_version), read with
+one small aggregate, so writes made by other processes such as the bot
+worker or an import show up immediately whatever the cache backend.
+Presence lives in the cache itself and is versioned by a token there,
+replaced by invalidate_presence().
+
+The a-prefixed functions are the same reads for async views, through the
+async cache and ORM APIs.
+"""
+import threading
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Case, Count, Max, Sum, When
+
+from .models import Conversation, Message
+
+_stats_lock = threading.Lock()
+_stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+
+
+def _record(name, hit):
+    with _stats_lock:
+        _stats[name]['hits' if hit else 'misses'] += 1
+
+
+def stats():
+    """
+    Hit and miss counters for this process, by cache name
+    """
+    with _stats_lock:
+        return {name: dict(counts) for name, counts in _stats.items()}
+
+
+def _version_key(name, scope):
+    return f'chat:version:{name}:{scope}'
+
+
+def version(name, scope=''):
+    """
+    Current version token of a cached value, created on first use
+    """
+    key = _version_key(name, scope)
+    token = cache.get(key)
+    if token is None:
+        token = uuid.uuid4().hex
+        # add() so that concurrent first readers agree on one token
+        if not cache.add(key, token, None):
+            token = cache.get(key, token)
+    return token
+
+
+async def aversion(name, scope=''):
+    key = _version_key(name, scope)
+    token = await cache.aget(key)
+    if token is None:
+        token = uuid.uuid4().hex
+        if not await cache.aadd(key, token, None):
+            token = await cache.aget(key, token)
+    return token
+
+
+def _invalidate(name, scope=''):
+    cache.set(_version_key(name, scope), uuid.uuid4().hex, None)
+
+
+def _get_or_compute(name, scope, compute, timeout, data_version=None):
+    key = f'chat:{name}:{scope}:{data_version or version(name, scope)}'
+    value = cache.get(key)
+    if value is not None:
+        _record(name, True)
+        return value
+    _record(name, False)
+    value = compute()
+    cache.set(key, value, timeout)
+    return value
+
+
+async def _aget_or_compute(name, scope, acompute, timeout, data_version=None):
+    key = f'chat:{name}:{scope}:{data_version or await aversion(name, scope)}'
+    value = await cache.aget(key)
+    if value is not None:
+        _record(name, True)
+        return value
+    _record(name, False)
+    value = await acompute()
+    await cache.aset(key, value, timeout)
+    return value
+
+
+def _directory_query():
+    return User.objects.order_by('username').values_list('id', 'username')
+
+
+def _directory_stats():
+    return User.objects.aggregate(count=Count('id'), latest=Max('id'))
+
+
+def _directory_version(stats, token):
+    # Sign-ups and deletions in any process change the row count or newest
+    # id; renames are caught by the token, replaced by the User signals
+    return f'{stats["count"]}-{stats["latest"]}-{token}'
+
+
+def directory_version():
+    """
+    Changes whenever a user is added, removed or renamed
+    """
+    return _directory_version(_directory_stats(), version('user_directory'))
+
+
+async def adirectory_version():
+    stats = await User.objects.aaggregate(count=Count('id'), latest=Max('id'))
+    return _directory_version(stats, await aversion('user_directory'))
+
+
+def user_directory():
+    """
+    (id, username) of every user, ordered by username
+    """
+    return _get_or_compute(
+        'user_directory', '',
+        lambda: list(_directory_query()),
+        settings.CHAT_CACHE_TIMEOUT,
+        directory_version(),
+    )
+
+
+async def auser_directory():
+    async def acompute():
+        return [row async for row in _directory_query()]
+
+    return await _aget_or_compute(
+        'user_directory', '', acompute, settings.CHAT_CACHE_TIMEOUT, await adirectory_version()
+    )
+
+
+def _summary(conversation, user_id):
+    return {
+        'unread_count': conversation.unread_for(user_id),
+        'last_read': conversation.last_read_for(user_id),
+        'last_message_preview': conversation.last_message_preview,
+        'last_message_at': conversation.last_message_at,
+    }
+
+
+def _conversations_stats(user_id):
+    def own(field):
+        # The user's side of each conversation
+        return Case(When(user_a=user_id, then=f'{field}_a'), default=f'{field}_b')
+
+    return Conversation.objects.for_user(user_id).order_by(), {
+        'count': Count('id'),
+        # Moves whenever a message is recorded in one of them
+        'last_messages': Sum('last_message_id'),
+        'unread': Sum(own('unread')),
+        # Watermarks only move forward, so any read changes the sum
+        'last_read': Sum(own('last_read')),
+    }
+
+
+def _conversations_version(stats):
+    return '{count}-{last_messages}-{unread}-{last_read}'.format(**stats)
+
+
+def conversations_version(user_id):
+    """
+    Changes whenever a message is recorded in one of the user's
+    conversations, or the user reads one. One aggregate over the user's
+    Conversation rows; no message is read.
+    """
+    conversations, aggregates = _conversations_stats(user_id)
+    return _conversations_version(conversations.aggregate(**aggregates))
+
+
+async def aconversations_version(user_id):
+    conversations, aggregates = _conversations_stats(user_id)
+    return _conversations_version(await conversations.aaggregate(**aggregates))
+
+
+def conversation_summaries(user_id):
+    """
+    The user's conversations keyed by the other participant's id
+    """
+    def compute():
+        return {
+            conversation.other_id(user_id): _summary(conversation, user_id)
+            for conversation in Conversation.objects.for_user(user_id)
+        }
+
+    return _get_or_compute(
+        'conversations', user_id, compute, settings.CHAT_CACHE_TIMEOUT, conversations_version(user_id)
+    )
+
+
+async def aconversation_summaries(user_id):
+    async def acompute():
+        return {
+            conversation.other_id(user_id): _summary(conversation, user_id)
+            async for conversation in Conversation.objects.for_user(user_id)
+        }
+
+    return await _aget_or_compute(
+        'conversations', user_id, acompute, settings.CHAT_CACHE_TIMEOUT, await aconversations_version(user_id)
+    )
+
+
+def presence_snapshot(online_map):
+    """
+    Online state of every user in the directory in one cache read, built
+    with `online_map` on a miss. The snapshot is replaced whenever someone
+    comes online or goes offline, and lives at most PRESENCE_FLUSH_INTERVAL
+    seconds so that TTL expiries show up too.
+    """
+    return _get_or_compute(
+        'presence', '',
+        lambda: online_map(user_id for user_id, username in user_directory()),
+        settings.PRESENCE_FLUSH_INTERVAL,
+    )
+
+
+async def apresence_snapshot(aonline_map):
+    async def acompute():
+        directory = await auser_directory()
+        return await aonline_map(user_id for user_id, username in directory)
+
+    return await _aget_or_compute('presence', '', acompute, settings.PRESENCE_FLUSH_INTERVAL)
+
+
+def inbox_version(user_id):
+    """
+    Changes whenever anything in the user's contact list may have changed
+    """
+    return '-'.join([directory_version(), conversations_version(user_id), version('presence')])
+
+
+async def ainbox_version(user_id):
+    return '-'.join([
+        await adirectory_version(),
+        await aconversations_version(user_id),
+        await aversion('presence'),
+    ])
+
+
+def _conversation_query(user_id, other_id):
+    if user_id == other_id:
+        # Notes to self have no Conversation row
+        return Message.objects.filter(sender=user_id, receiver=user_id).order_by('-timestamp', '-id').values_list(
+            'id', 'timestamp'
+        )
+    pair = (user_id, other_id) if user_id < other_id else (other_id, user_id)
+    return Conversation.objects.filter(user_a=pair[0], user_b=pair[1]).values_list(
+        'last_message_id', 'last_message_at'
+    )
+
+
+def conversation_version(user_id, other_id):
+    """
+    Changes whenever a message is sent between the two users, in any
+    process: their Conversation row's last-message pointer, read with one
+    lookup on its unique index
+    """
+    return '-'.join(map(str, _conversation_query(user_id, other_id).first() or ()))
+
+
+async def aconversation_version(user_id, other_id):
+    return '-'.join(map(str, await _conversation_query(user_id, other_id).afirst() or ()))
+
+
+def invalidate_user_directory():
+    _invalidate('user_directory')
+    # The presence snapshot covers exactly the directory's users
+    _invalidate('presence')
+
+
+def invalidate_presence():
+    _invalidate('presence')
+
+
+def invalidate_all():
+    """
+    Drop every cached chat value that is not versioned by the database,
+    e.g. after a bulk rebuild
+    """
+    _invalidate('user_directory')
+    _invalidate('presence')
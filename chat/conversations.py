@@ -0,0 +1,226 @@
+"""
+Maintenance of the denormalized Conversation rows.
+
+Every code path that creates messages calls into this module inside the
+same transaction, so Conversation never drifts from Message.
+Once the transaction commits, the change is pushed to connected clients.
+
+Read state is kept as a watermark per participant (see Conversation), so
+polling a conversation never updates Message rows.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from . import caching, events
+from .models import Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_LENGTH = 100
+
+_reads_lock = threading.Lock()
+# (reader_id, other_id) -> newest message id read, waiting to be flushed
+_pending_reads = {}
+_flush_timer = None
+
+
+def ordered_pair(user_id, other_id):
+    return (user_id, other_id) if user_id < other_id else (other_id, user_id)
+
+
+def _unread_field(conversation_pair, reader_id):
+    return 'unread_a' if reader_id == conversation_pair[0] else 'unread_b'
+
+
+def record_messages(messages):
+    """
+    Fold newly created messages into their conversations: bump the receiver's
+    unread counter and move the last-message pointer forward.
+    Must be called inside the transaction that created the messages.
+    """
+    messages = list(messages)
+    transaction.on_commit(lambda: _messages_committed(messages))
+
+    for message in messages:
+        if message.sender_id == message.receiver_id:
+            continue
+        pair = ordered_pair(message.sender_id, message.receiver_id)
+        conversation, created = Conversation.objects.get_or_create(user_a_id=pair[0], user_b_id=pair[1])
+        conversations = Conversation.objects.filter(pk=conversation.pk)
+
+        unread_field = _unread_field(pair, message.receiver_id)
+        conversations.update(**{unread_field: F(unread_field) + 1})
+
+        # Messages may be recorded out of order; never move the pointer back
+        conversations.filter(
+            Q(last_message_at__isnull=True) | Q(last_message_at__lte=message.timestamp)
+        ).update(
+            last_message=message,
+            last_message_preview=message.content[:PREVIEW_LENGTH],
+            last_message_at=message.timestamp,
+        )
+
+
+def _messages_committed(messages):
+    # Cached summaries and ETags are versioned by the rows just written
+    publish_messages(messages)
+
+
+def publish_messages(messages):
+    """
+    Push new messages to both participants' open connections
+    """
+    events.publish_many(
+        (user_id, {
+            'type': 'message',
+            'conversation': other_id,
+            'message': message.to_dict(user_id),
+        })
+        for message in messages
+        for user_id, other_id in {(message.receiver_id, message.sender_id), (message.sender_id, message.receiver_id)}
+    )
+
+
+def record_message(message):
+    record_messages([message])
+
+
+def unread_count(reader, other, watermark):
+    """
+    Subquery counting the messages from `other` to `reader` above `watermark`,
+    for use in Conversation updates. `reader` and `other` name Conversation
+    fields; `watermark` is a message id or an expression.
+    """
+    return Coalesce(Subquery(
+        Message.objects.filter(sender=OuterRef(other), receiver=OuterRef(reader), id__gt=watermark)
+        .order_by()
+        .values('receiver')
+        .annotate(count=Count('id'))
+        .values('count')
+    ), 0)
+
+
+def _pending_read(reader_id, other_id):
+    with _reads_lock:
+        return _pending_reads.get((reader_id, other_id), 0)
+
+
+def read_watermark(reader_id, other_id):
+    """
+    Newest message id the reader has read from the other user, including
+    advances that have not been flushed yet
+    """
+    summary = caching.conversation_summaries(reader_id).get(other_id, {})
+    return max(summary.get('last_read', 0), _pending_read(reader_id, other_id))
+
+
+async def aread_watermark(reader_id, other_id):
+    summary = (await caching.aconversation_summaries(reader_id)).get(other_id, {})
+    return max(summary.get('last_read', 0), _pending_read(reader_id, other_id))
+
+
+def _newest_from(other, messages):
+    return max((message.id for message in messages if message.sender_id == other.id), default=0)
+
+
+def mark_seen(reader, other, messages):
+    """
+    Move the reader's watermark past the messages from `other` they were
+    just shown. Costs no write when there is nothing new to read.
+    """
+    newest = _newest_from(other, messages)
+    if newest > read_watermark(reader.id, other.id):
+        mark_read(reader.id, other.id, newest)
+
+
+async def amark_seen(reader, other, messages):
+    newest = _newest_from(other, messages)
+    if newest > await aread_watermark(reader.id, other.id):
+        mark_read(reader.id, other.id, newest)
+
+
+def mark_read(reader_id, other_id, message_id):
+    """
+    Queue a watermark advance. Advances are coalesced in memory and written
+    together by flush_reads(), READ_FLUSH_INTERVAL seconds after the first
+    one, so unread counters may lag a read by that long. Never touches the
+    database itself, so async views can call it directly.
+    """
+    global _flush_timer
+    with _reads_lock:
+        key = (reader_id, other_id)
+        if message_id <= _pending_reads.get(key, 0):
+            return
+        _pending_reads[key] = message_id
+        if len(_pending_reads) >= settings.READ_FLUSH_MAX_PENDING:
+            if _flush_timer is not None:
+                if _flush_timer.interval == 0:
+                    return
+                _flush_timer.cancel()
+            # Flush straight away rather than wait for the timer
+            delay = 0
+        elif _flush_timer is None:
+            delay = settings.READ_FLUSH_INTERVAL
+        else:
+            return
+        _flush_timer = threading.Timer(delay, _flush_in_background)
+        _flush_timer.daemon = True
+        _flush_timer.start()
+
+
+def _flush_in_background():
+    try:
+        flush_reads()
+    except Exception:
+        logger.exception('Failed to flush read watermarks')
+    finally:
+        connection.close()
+
+
+def flush_reads():
+    """
+    Write every pending watermark advance in one transaction, recomputing
+    the readers' unread counters from the new watermarks. Watermarks never
+    move back. Returns the number of conversations that advanced.
+    """
+    global _pending_reads, _flush_timer
+    with _reads_lock:
+        pending, _pending_reads = _pending_reads, {}
+        if _flush_timer is not None:
+            _flush_timer.cancel()
+            _flush_timer = None
+    if not pending:
+        return 0
+
+    advanced = []
+    with transaction.atomic():
+        for (reader_id, other_id), message_id in pending.items():
+            pair = ordered_pair(reader_id, other_id)
+            reader, other = ('a', 'b') if reader_id == pair[0] else ('b', 'a')
+            updated = Conversation.objects.filter(
+                user_a_id=pair[0], user_b_id=pair[1], **{f'last_read_{reader}__lt': message_id}
+            ).update(**{
+                f'last_read_{reader}': message_id,
+                f'unread_{reader}': unread_count(f'user_{reader}', f'user_{other}', message_id),
+            })
+            if updated:
+                advanced.append((reader_id, other_id, message_id))
+        transaction.on_commit(lambda: _reads_committed(advanced))
+    return len(advanced)
+
+
+def _reads_committed(advanced):
+    # Read receipts for the other participants
+    events.publish_many(
+        (other_id, {
+            'type': 'read',
+            'conversation': reader_id,
+            'message_id': message_id,
+        })
+        for reader_id, other_id, message_id in advanced
+    )
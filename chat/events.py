@@ -0,0 +1,234 @@
+"""
+Publish/subscribe for real-time chat events.
+
+Views and the bot path publish events for a user; every open WebSocket of
+that user receives them. The broker class is chosen by the
+CHAT_EVENT_BROKER setting. InProcessBroker only reaches the subscribers of
+the publishing process; DatabaseBroker, the default, also passes events
+through the ChatEvent table, so bot replies stored by run_bot_worker and
+events of other web processes reach every client.
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import ChatEvent
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    Queue of events for one connection, bound to the event loop that reads it
+    """
+
+    def __init__(self, user_id, maxsize=100):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def put(self, event):
+        # May be called from any thread
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The connection's event loop is already closed
+            pass
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A slow client misses events and resyncs through the message API
+            logger.warning("Dropping chat event for user %s: queue full", self.user_id)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class InProcessBroker:
+    """
+    Fan-out to the subscribers connected to this process
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id)
+        with self._lock:
+            self._subscribers[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def publish(self, user_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def publish_many(self, events):
+        """
+        publish() every (user_id, event) pair
+        """
+        for user_id, event in events:
+            self.publish(user_id, event)
+
+    def broadcast(self, event):
+        with self._lock:
+            subscribers = [s for group in self._subscribers.values() for s in group]
+        for subscription in subscribers:
+            subscription.put(event)
+
+
+class DatabaseBroker(InProcessBroker):
+    """
+    Fan-out shared by every process using the same database.
+
+    Events are delivered to this process's subscribers straight away and
+    stored as ChatEvent rows. Once something subscribes here, a thread
+    reads the rows published by other processes every
+    CHAT_EVENT_POLL_INTERVAL seconds and delivers them too; it also
+    deletes rows older than CHAT_EVENT_RETENTION seconds.
+    """
+
+    # Rows read per poll
+    BATCH_SIZE = 500
+    # Seconds an id skipped over by the cursor is looked for again: on
+    # PostgreSQL a transaction holding a lower id may commit after a higher one
+    GAP_TIMEOUT = 5
+    # Longest run of skipped ids that is tracked
+    MAX_GAP = 1000
+
+    def __init__(self):
+        super().__init__()
+        # Tells the rows this process published, and already delivered, apart
+        self.origin = uuid.uuid4().hex
+        self._reader = None
+        self._cursor = None
+        # skipped id -> time.monotonic() it was skipped
+        self._gaps = {}
+        self._pruned = 0
+
+    def subscribe(self, user_id):
+        subscription = super().subscribe(user_id)
+        with self._lock:
+            if self._reader is None:
+                self._reader = threading.Thread(target=self._read_forever, name='chat-events', daemon=True)
+                self._reader.start()
+        return subscription
+
+    def publish(self, user_id, event):
+        super().publish(user_id, event)
+        self._store([(user_id, event)])
+
+    def publish_many(self, events):
+        events = list(events)
+        for user_id, event in events:
+            super().publish(user_id, event)
+        self._store(events)
+
+    def broadcast(self, event):
+        super().broadcast(event)
+        self._store([(None, event)])
+
+    def _store(self, events):
+        # Local subscribers already have the events; never fail the publisher
+        try:
+            ChatEvent.objects.bulk_create([
+                ChatEvent(user_id=user_id, payload=event, origin=self.origin) for user_id, event in events
+            ])
+        except Exception:
+            logger.exception('Failed to store %d chat event(s)', len(events))
+
+    def _read_forever(self):
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Failed to read chat events')
+                connection.close()
+            time.sleep(settings.CHAT_EVENT_POLL_INTERVAL)
+
+    def poll(self):
+        """
+        Deliver the events other processes stored since the last poll.
+        Returns the number delivered.
+        """
+        if self._cursor is None:
+            # Start from now; older events were for connections long gone
+            self._cursor = ChatEvent.objects.aggregate(latest=Max('id'))['latest'] or 0
+
+        now = time.monotonic()
+        rows = (
+            ChatEvent.objects.filter(Q(id__gt=self._cursor) | Q(id__in=list(self._gaps)))
+            .order_by('id')
+            .values_list('id', 'user_id', 'payload', 'origin')[:self.BATCH_SIZE]
+        )
+        delivered = 0
+        for event_id, user_id, payload, origin in rows:
+            self._gaps.pop(event_id, None)
+            if event_id > self._cursor:
+                if event_id - self._cursor <= self.MAX_GAP:
+                    for skipped in range(self._cursor + 1, event_id):
+                        self._gaps[skipped] = now
+                self._cursor = event_id
+            if origin == self.origin:
+                continue
+            if user_id is None:
+                super().broadcast(payload)
+            else:
+                super().publish(user_id, payload)
+            delivered += 1
+        # Ids left behind by rolled-back transactions never show up
+        self._gaps = {event_id: at for event_id, at in self._gaps.items() if now - at < self.GAP_TIMEOUT}
+
+        if now - self._pruned >= settings.CHAT_EVENT_RETENTION:
+            ChatEvent.objects.filter(
+                created_at__lt=timezone.now() - timedelta(seconds=settings.CHAT_EVENT_RETENTION)
+            ).delete()
+            self._pruned = now
+        return delivered
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(settings.CHAT_EVENT_BROKER)()
+    return _broker
+
+
+def publish(user_id, event):
+    get_broker().publish(user_id, event)
+
+
+def publish_many(events):
+    get_broker().publish_many(events)
+
+
+def broadcast(event):
+    get_broker().broadcast(event)
@@ -0,0 +1,56 @@
+"""
+NDJSON export of messages.
+
+One JSON object per line: id, sender and receiver (usernames, so an export
+can be loaded into another database with `import_messages`), content,
+is_bot_response and timestamp. Rows are read with values() and
+iterator(chunk_size), never as model instances, so memory use does not
+grow with the number of messages. Archived messages come first, then the
+live ones, each oldest first.
+"""
+import json
+
+from django.db.models import Q
+
+from .models import ArchivedMessage, Message
+
+FIELDS = ('id', 'sender__username', 'receiver__username', 'content', 'is_bot_response', 'timestamp')
+
+
+def _querysets(user=None, other=None):
+    querysets = []
+    for model in (ArchivedMessage, Message):
+        messages = model.objects.all()
+        if other is not None:
+            messages = messages.between(user, other)
+        elif user is not None:
+            messages = messages.filter(Q(sender=user) | Q(receiver=user))
+        querysets.append(messages.order_by('id').values(*FIELDS))
+    return querysets
+
+
+def to_line(row):
+    return json.dumps({
+        'id': row['id'],
+        'sender': row['sender__username'],
+        'receiver': row['receiver__username'],
+        'content': row['content'],
+        'is_bot_response': row['is_bot_response'],
+        'timestamp': row['timestamp'].isoformat(),
+    }) + '\n'
+
+
+def export_lines(user=None, other=None, chunk_size=2000):
+    """
+    NDJSON lines of every message, or of the messages of `user`, or of
+    their conversation with `other`
+    """
+    for rows in _querysets(user, other):
+        for row in rows.iterator(chunk_size=chunk_size):
+            yield to_line(row)
+
+
+async def aexport_lines(user=None, other=None, chunk_size=2000):
+    for rows in _querysets(user, other):
+        async for row in rows.aiterator(chunk_size=chunk_size):
+            yield to_line(row)
@@ -0,0 +1,55 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import archive
+from chat.models import Message
+
+
+class Command(BaseCommand):
+    help = 'Move messages older than the retention horizon to the archive table, in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.MESSAGE_RETENTION_DAYS,
+                            help='Archive messages older than this many days')
+        parser.add_argument('--batch-size', type=int, default=settings.ARCHIVE_BATCH_SIZE,
+                            help='Messages moved per transaction')
+        parser.add_argument('--pause', type=float, default=settings.ARCHIVE_BATCH_PAUSE,
+                            help='Seconds to sleep between batches, so other writers get the lock')
+        parser.add_argument('--max-batches', type=int,
+                            help='Stop after this many batches; the next run carries on')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the messages that would be archived')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        before = archive.cutoff(options['days'])
+        if options['dry_run']:
+            count = Message.objects.filter(timestamp__lt=before).count()
+            self.stdout.write(f'{count} messages sent before {before:%Y-%m-%d %H:%M} would be archived')
+            return
+
+        started = time.monotonic()
+        moved = batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            count = archive.archive_batch(before, options['batch_size'])
+            if not count:
+                break
+            moved += count
+            batches += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f'batch {batches}: {count} messages')
+            if count < options['batch_size']:
+                break
+            time.sleep(options['pause'])
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'Archived {moved} messages sent before {before:%Y-%m-%d %H:%M} '
+            f'in {batches} batches ({elapsed:.1f}s)'
+        )
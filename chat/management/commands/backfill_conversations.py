@@ -0,0 +1,70 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max, OuterRef
+
+from chat import caching
+from chat.conversations import PREVIEW_LENGTH, ordered_pair, unread_count
+from chat.models import Conversation, Message
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the Conversation table from existing messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Conversations written per transaction')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        batch_size = options['batch_size']
+
+        # One row per direction: (sender, receiver) -> newest message id
+        pairs = {}
+        directions = (
+            Message.objects.exclude(sender=F('receiver'))
+            .order_by()
+            .values('sender', 'receiver')
+            .annotate(last_id=Max('id'))
+        )
+        for row in directions.iterator():
+            pair = ordered_pair(row['sender'], row['receiver'])
+            pairs[pair] = max(pairs.get(pair, 0), row['last_id'])
+
+        items = list(pairs.items())
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            last_messages = Message.objects.in_bulk([last_id for pair, last_id in batch])
+
+            conversations = []
+            for (user_a, user_b), last_id in batch:
+                last_message = last_messages[last_id]
+                conversations.append(Conversation(
+                    user_a_id=user_a,
+                    user_b_id=user_b,
+                    last_message=last_message,
+                    last_message_preview=last_message.content[:PREVIEW_LENGTH],
+                    last_message_at=last_message.timestamp,
+                ))
+
+            with transaction.atomic():
+                # Existing rows keep their read watermarks
+                Conversation.objects.bulk_create(
+                    conversations,
+                    update_conflicts=True,
+                    unique_fields=['user_a', 'user_b'],
+                    update_fields=['last_message', 'last_message_preview', 'last_message_at'],
+                )
+                # Unread counters follow from the watermarks
+                Conversation.objects.filter(
+                    last_message_id__in=[conversation.last_message_id for conversation in conversations]
+                ).update(
+                    unread_a=unread_count('user_a', 'user_b', OuterRef('last_read_a')),
+                    unread_b=unread_count('user_b', 'user_a', OuterRef('last_read_b')),
+                )
+
+        caching.invalidate_all()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {len(items)} conversation(s) in {elapsed:.1f}s'))
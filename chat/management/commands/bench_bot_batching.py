@@ -0,0 +1,57 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import ai_utils
+from chat.benchmarks import SAMPLE_PROMPTS
+
+
+class Command(BaseCommand):
+    help = 'Measure AI bot reply throughput for different batch sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-sizes', default='1,2,4,8,16',
+                            help='Comma-separated batch sizes to measure')
+        parser.add_argument('--rounds', type=int, default=3,
+                            help='Timed generate() calls per batch size')
+        parser.add_argument('--json', dest='json_path',
+                            help='Also write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        if not ai_utils.TRANSFORMERS_AVAILABLE:
+            raise CommandError('Transformers is not installed')
+
+        batch_sizes = [int(size) for size in options['batch_sizes'].split(',')]
+        rounds = max(1, options['rounds'])
+
+        # Load the model and warm up outside the timed section
+        ai_utils.registry.get()
+        ai_utils.generate_replies(SAMPLE_PROMPTS[:1])
+        threads = ai_utils.torch.get_num_threads()
+
+        self.stdout.write(f'threads={threads}')
+        self.stdout.write(f'{"batch":>6} {"seconds/call":>13} {"replies/s":>10} {"replies/s/core":>15}')
+
+        results = []
+        for batch_size in batch_sizes:
+            prompts = [SAMPLE_PROMPTS[i % len(SAMPLE_PROMPTS)] for i in range(batch_size)]
+            started = time.perf_counter()
+            for _ in range(rounds):
+                ai_utils.generate_replies(prompts)
+            elapsed = (time.perf_counter() - started) / rounds
+
+            throughput = batch_size / elapsed
+            results.append({
+                'batch_size': batch_size,
+                'seconds_per_call': elapsed,
+                'replies_per_second': throughput,
+                'replies_per_second_per_core': throughput / threads,
+            })
+            self.stdout.write(
+                f'{batch_size:>6} {elapsed:>13.3f} {throughput:>10.2f} {throughput / threads:>15.3f}'
+            )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump({'threads': threads, 'results': results}, f, indent=2)
@@ -0,0 +1,203 @@
+import asyncio
+import io
+import json
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client
+
+from chat import metrics
+from chat.benchmarks import percentile
+from chat.models import Message, UserStatus
+
+ENDPOINTS = ['get_users', 'get_messages', 'send_message', 'chat_view']
+USERNAME_PREFIX = 'bench-user-'
+
+def request_args(endpoint, other_id):
+    """
+    Method, path and extra client arguments for one request to `endpoint`
+    """
+    if endpoint == 'get_users':
+        return 'get', '/api/users/', {}
+    if endpoint == 'get_messages':
+        return 'get', f'/api/messages/{other_id}/', {}
+    if endpoint == 'send_message':
+        return 'post', f'/api/send_message/{other_id}/', {
+            'data': json.dumps({'content': 'benchmark message'}),
+            'content_type': 'application/json',
+        }
+    return 'get', f'/chat/{other_id}/', {}
+
+
+class Command(BaseCommand):
+    help = 'Seed users and messages, then measure latency, throughput and query counts of the chat endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20,
+                            help='Users to seed')
+        parser.add_argument('--messages', type=int, default=2000,
+                            help='Messages to seed between random pairs of users')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests per endpoint')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Requests in flight at once')
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                            help='Comma-separated endpoints to measure')
+        parser.add_argument('--mode', choices=['wsgi', 'asgi'], default='wsgi',
+                            help='Drive the test client from threads (wsgi) or the ASGI handler from one event loop (asgi)')
+        parser.add_argument('--json', dest='json_path',
+                            help='Also write the results to this JSON file')
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the seeded users and messages')
+        parser.add_argument('--random-seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        endpoints = options['endpoints'].split(',')
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError(f'Unknown endpoint(s): {", ".join(sorted(unknown))}')
+        if options['users'] < 2:
+            raise CommandError('Seed at least 2 users')
+        if User.objects.filter(username__startswith=USERNAME_PREFIX).exists():
+            raise CommandError(f'Users named {USERNAME_PREFIX}* already exist; delete them first')
+
+        self.random = random.Random(options['random_seed'])
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+        # Measure the endpoints, not the send rate limits
+        settings.SEND_RATE_SENDER = settings.SEND_RATE_RECEIVER = 0
+
+        try:
+            users = self.seed(options['users'], options['messages'])
+            results = {}
+            for endpoint in endpoints:
+                if options['mode'] == 'asgi':
+                    samples = asyncio.run(self.drive_asgi(endpoint, users, options))
+                else:
+                    samples = self.drive_wsgi(endpoint, users, options)
+                results[endpoint] = self.summarize(samples)
+                self.report(endpoint, results[endpoint])
+        finally:
+            if not options['keep']:
+                # Cascades to their messages, conversations and statuses
+                User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump({
+                    'database': connection.vendor,
+                    'mode': options['mode'],
+                    'users': options['users'],
+                    'messages': options['messages'],
+                    'requests': options['requests'],
+                    'concurrency': options['concurrency'],
+                    'results': results,
+                }, f, indent=2)
+
+    def seed(self, user_count, message_count):
+        started = time.monotonic()
+        # Hash once; every seeded user shares the password
+        password = make_password('benchmark')
+        User.objects.bulk_create(
+            User(username=f'{USERNAME_PREFIX}{i}', password=password) for i in range(user_count)
+        )
+        users = list(User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('id'))
+        UserStatus.objects.bulk_create(UserStatus(user=user) for user in users)
+
+        messages = []
+        for _ in range(message_count):
+            sender, receiver = self.random.sample(users, 2)
+            messages.append(Message(sender=sender, receiver=receiver, content='seeded message'))
+        Message.objects.bulk_create(messages, batch_size=1000)
+        call_command('backfill_conversations', stdout=io.StringIO())
+
+        self.stdout.write(f'Seeded {user_count} users and {message_count} messages in {time.monotonic() - started:.1f}s')
+        return users
+
+    def plan(self, users, count):
+        """
+        (user, other user) for each request, so both modes replay the same load
+        """
+        return [tuple(self.random.sample(users, 2)) for _ in range(count)]
+
+    def drive_wsgi(self, endpoint, users, options):
+        plan = self.plan(users, options['requests'])
+        samples = []
+        lock = threading.Lock()
+
+        def worker(jobs):
+            clients = {}
+            try:
+                for user, other in jobs:
+                    if user.id not in clients:
+                        clients[user.id] = Client()
+                        clients[user.id].force_login(user)
+                    method, path, extra = request_args(endpoint, other.id)
+                    with metrics.track() as timings:
+                        response = getattr(clients[user.id], method)(path, **extra)
+                        elapsed = timings.elapsed()
+                    with lock:
+                        samples.append((elapsed, timings.queries, response.status_code))
+            finally:
+                connection.close()
+
+        concurrency = max(1, options['concurrency'])
+        threads = [threading.Thread(target=worker, args=(plan[i::concurrency],)) for i in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return samples, time.perf_counter() - started
+
+    async def drive_asgi(self, endpoint, users, options):
+        plan = self.plan(users, options['requests'])
+        clients = {}
+        for user, other in plan:
+            if user.id not in clients:
+                clients[user.id] = AsyncClient()
+                await clients[user.id].aforce_login(user)
+
+        semaphore = asyncio.Semaphore(max(1, options['concurrency']))
+        samples = []
+
+        async def one(user, other):
+            async with semaphore:
+                method, path, extra = request_args(endpoint, other.id)
+                with metrics.track() as timings:
+                    response = await getattr(clients[user.id], method)(path, **extra)
+                samples.append((timings.elapsed(), timings.queries, response.status_code))
+
+        started = time.perf_counter()
+        # Each request runs in its own task, so its timings stay its own
+        await asyncio.gather(*[one(user, other) for user, other in plan])
+        return samples, time.perf_counter() - started
+
+    def summarize(self, samples):
+        samples, elapsed = samples
+        latencies = [latency for latency, queries, status in samples]
+        queries = [queries for latency, queries, status in samples]
+        return {
+            'requests': len(samples),
+            'errors': sum(1 for latency, queries, status in samples if status >= 400),
+            'seconds': elapsed,
+            'throughput': len(samples) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'queries_mean': sum(queries) / len(queries) if queries else 0.0,
+            'queries_max': max(queries, default=0),
+        }
+
+    def report(self, endpoint, result):
+        self.stdout.write(
+            f'{endpoint:<13} {result["throughput"]:>8.1f} req/s  '
+            f'p50 {result["p50_ms"]:>7.2f} ms  p95 {result["p95_ms"]:>7.2f} ms  p99 {result["p99_ms"]:>7.2f} ms  '
+            f'queries {result["queries_mean"]:.1f} (max {result["queries_max"]})  errors {result["errors"]}'
+        )
@@ -0,0 +1,114 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import ai_utils
+from chat.benchmarks import SAMPLE_PROMPTS, peak_rss_mb, percentile, rss_mb
+
+# Mode name -> settings overrides, passed to the child process as environment variables
+MODES = {
+    'fp32': {'AI_BOT_BACKEND': 'chat.ai_utils.TorchBackend', 'AI_BOT_DTYPE': 'float32'},
+    'bf16': {'AI_BOT_BACKEND': 'chat.ai_utils.TorchBackend', 'AI_BOT_DTYPE': 'bfloat16'},
+    'int8': {'AI_BOT_BACKEND': 'chat.ai_utils.QuantizedCPUBackend'},
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare reply latency and memory of the AI bot inference backends on the same prompts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', default=','.join(MODES),
+                            help=f'Comma-separated modes to compare ({", ".join(MODES)})')
+        parser.add_argument('--rounds', type=int, default=3,
+                            help='Passes over the sample prompts per mode')
+        parser.add_argument('--threads', type=int, default=settings.AI_BOT_NUM_THREADS,
+                            help='Intra-op threads (0 keeps the torch default)')
+        parser.add_argument('--beams', type=int, default=settings.AI_BOT_NUM_BEAMS)
+        parser.add_argument('--max-new-tokens', type=int, default=settings.AI_BOT_MAX_NEW_TOKENS)
+        parser.add_argument('--json', dest='json_path',
+                            help='Also write the results to this JSON file')
+        parser.add_argument('--child', action='store_true',
+                            help='Internal: measure the configured backend in this process')
+
+    def handle(self, *args, **options):
+        if options['child']:
+            self.measure(options)
+            return
+
+        modes = options['modes'].split(',')
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f'Unknown mode(s): {", ".join(sorted(unknown))}')
+
+        self.stdout.write(
+            f'{"mode":<6} {"load s":>7} {"p50 ms":>8} {"p95 ms":>8} {"mean ms":>8} {"rss MB":>8} {"peak MB":>8}'
+        )
+        results = {}
+        for mode in modes:
+            # Each mode runs in a fresh process, so memory figures don't add up
+            env = dict(
+                os.environ,
+                **MODES[mode],
+                AI_BOT_NUM_THREADS=str(options['threads']),
+                AI_BOT_NUM_BEAMS=str(options['beams']),
+                AI_BOT_MAX_NEW_TOKENS=str(options['max_new_tokens']),
+                AI_BOT_PRELOAD='False',
+            )
+            child = subprocess.run(
+                [sys.executable, sys.argv[0], 'bench_inference_backends', '--child',
+                 '--rounds', str(options['rounds'])],
+                env=env, capture_output=True, text=True,
+            )
+            if child.returncode != 0:
+                self.stderr.write(f'{mode}: failed\n{child.stderr.strip()}')
+                continue
+            result = results[mode] = json.loads(child.stdout.strip().splitlines()[-1])
+            self.stdout.write(
+                f'{mode:<6} {result["load_seconds"]:>7.1f} {result["p50_ms"]:>8.0f} {result["p95_ms"]:>8.0f} '
+                f'{result["mean_ms"]:>8.0f} {result["rss_mb"]:>8.0f} {result["peak_rss_mb"]:>8.0f}'
+            )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump({
+                    'threads': options['threads'],
+                    'beams': options['beams'],
+                    'max_new_tokens': options['max_new_tokens'],
+                    'results': results,
+                }, f, indent=2)
+
+    def measure(self, options):
+        if not ai_utils.TRANSFORMERS_AVAILABLE:
+            raise CommandError('Transformers is not installed')
+
+        baseline = rss_mb()
+        started = time.perf_counter()
+        ai_utils.registry.get()
+        load_seconds = time.perf_counter() - started
+        # Warm up outside the timed section
+        ai_utils.generate_replies(SAMPLE_PROMPTS[:1])
+
+        latencies = []
+        for _ in range(max(1, options['rounds'])):
+            for prompt in SAMPLE_PROMPTS:
+                started = time.perf_counter()
+                ai_utils.generate_replies([prompt])
+                latencies.append(time.perf_counter() - started)
+
+        self.stdout.write(json.dumps({
+            'backend': settings.AI_BOT_BACKEND,
+            'dtype': settings.AI_BOT_DTYPE,
+            'threads': ai_utils.torch.get_num_threads(),
+            'load_seconds': load_seconds,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'mean_ms': sum(latencies) / len(latencies) * 1000,
+            'baseline_rss_mb': baseline,
+            'rss_mb': rss_mb(),
+            'peak_rss_mb': peak_rss_mb(),
+        }))
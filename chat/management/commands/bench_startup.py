@@ -0,0 +1,129 @@
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import get_resolver
+
+from chat.benchmarks import rss_mb
+
+# Libraries that must only be imported when the AI bot model is loaded
+HEAVY_MODULES = ['torch', 'transformers']
+
+# "import time: <self us> | <cumulative us> | <indented module name>"
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def parse_importtime(output):
+    """
+    (cumulative microseconds, module) of the top-level imports in
+    `python -X importtime` output, and the total of all self times
+    """
+    top_level = []
+    total = 0
+    for line in output.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        total += int(self_us)
+        if len(indent) == 1:
+            top_level.append((int(cumulative_us), module))
+    return sorted(top_level, reverse=True), total
+
+
+class Command(BaseCommand):
+    help = 'Measure process startup: cold `manage.py check` time, import times and baseline memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5,
+                            help='Cold `manage.py check` runs to time')
+        parser.add_argument('--top', type=int, default=15,
+                            help='Slowest top-level imports to list')
+        parser.add_argument('--max-seconds', type=float,
+                            help='Fail if the median `manage.py check` time is above this')
+        parser.add_argument('--max-rss-mb', type=float,
+                            help='Fail if the baseline RSS is above this')
+        parser.add_argument('--json', dest='json_path',
+                            help='Also write the results to this JSON file')
+        parser.add_argument('--child', action='store_true',
+                            help='Internal: report the memory and modules of this process')
+
+    def handle(self, *args, **options):
+        if options['child']:
+            self.measure()
+            return
+
+        manage_py = str(settings.BASE_DIR / 'manage.py')
+        # Startup is measured without the optional model preload
+        env = dict(os.environ, AI_BOT_PRELOAD='False')
+
+        timings = []
+        for _ in range(max(1, options['runs'])):
+            started = time.perf_counter()
+            self.run([sys.executable, manage_py, 'check'], env)
+            timings.append(time.perf_counter() - started)
+
+        imports, import_us = parse_importtime(
+            self.run([sys.executable, '-X', 'importtime', manage_py, 'check'], env).stderr
+        )
+        baseline = json.loads(
+            self.run([sys.executable, manage_py, 'bench_startup', '--child'], env).stdout.strip().splitlines()[-1]
+        )
+
+        result = {
+            'check_seconds_first': timings[0],
+            'check_seconds_median': statistics.median(timings),
+            'check_seconds_min': min(timings),
+            'import_seconds': import_us / 1e6,
+            'slowest_imports': [{'module': module, 'seconds': us / 1e6} for us, module in imports[:options['top']]],
+            **baseline,
+        }
+        self.report(result)
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(result, f, indent=2)
+
+        failures = []
+        if result['heavy_modules']:
+            failures.append(f'imported at startup: {", ".join(result["heavy_modules"])}')
+        if options['max_seconds'] is not None and result['check_seconds_median'] > options['max_seconds']:
+            failures.append(f'median check time {result["check_seconds_median"]:.2f}s > {options["max_seconds"]}s')
+        if options['max_rss_mb'] is not None and result['rss_mb'] > options['max_rss_mb']:
+            failures.append(f'baseline RSS {result["rss_mb"]:.0f} MB > {options["max_rss_mb"]} MB')
+        if failures:
+            raise CommandError('Startup regression: ' + '; '.join(failures))
+
+    def run(self, command, env):
+        child = subprocess.run(command, env=env, capture_output=True, text=True)
+        if child.returncode != 0:
+            raise CommandError(f'{" ".join(command)} failed\n{child.stderr.strip()}')
+        return child
+
+    def measure(self):
+        # Load the URLconf, and with it every view module, as a web worker does
+        get_resolver().url_patterns
+        self.stdout.write(json.dumps({
+            'rss_mb': rss_mb(),
+            'modules': len(sys.modules),
+            'heavy_modules': [name for name in HEAVY_MODULES if name in sys.modules],
+        }))
+
+    def report(self, result):
+        self.stdout.write(
+            f'manage.py check: first {result["check_seconds_first"]:.2f}s  '
+            f'median {result["check_seconds_median"]:.2f}s  min {result["check_seconds_min"]:.2f}s'
+        )
+        self.stdout.write(f'imports: {result["import_seconds"]:.2f}s in total, slowest top-level:')
+        for entry in result['slowest_imports']:
+            self.stdout.write(f'  {entry["seconds"] * 1000:>8.1f} ms  {entry["module"]}')
+        self.stdout.write(
+            f'baseline RSS {result["rss_mb"]:.0f} MB, {result["modules"]} modules loaded, '
+            f'heavy modules: {", ".join(result["heavy_modules"]) or "none"}'
+        )
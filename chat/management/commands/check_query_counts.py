@@ -0,0 +1,70 @@
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from chat import caching, views
+from chat.conversations import record_message
+from chat.models import Message
+
+
+class _Rollback(Exception):
+    pass
+
+
+def count_queries(view, request, *args):
+    # Async views run their queries on this thread under async_to_sync
+    with CaptureQueriesContext(connection) as queries:
+        async_to_sync(view)(request, *args)
+    return len(queries)
+
+
+def as_user(request, user):
+    async def auser():
+        return user
+
+    request.user = user
+    request.auser = auser
+    return request
+
+
+class Command(BaseCommand):
+    help = 'Check that the polling endpoints run a constant number of queries as users are added'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='5,50',
+                            help='Comma-separated numbers of users to compare')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        factory = RequestFactory()
+
+        counts = {}
+        # Seed inside a transaction that is always rolled back
+        try:
+            with transaction.atomic():
+                me = User.objects.create_user('query-count-me')
+                created = 0
+                for size in sizes:
+                    for i in range(created, size):
+                        other = User.objects.create_user(f'query-count-{i}')
+                        record_message(Message.objects.create(sender=other, receiver=me, content='unread'))
+                    created = max(created, size)
+
+                    # Measure the cold-cache cost
+                    caching.invalidate_all()
+                    request = as_user(factory.get('/api/users/'), me)
+                    counts[size] = count_queries(views.get_users, request)
+                    self.stdout.write(f'get_users with {size} other users: {counts[size]} queries')
+                raise _Rollback
+        except _Rollback:
+            pass
+        finally:
+            # Don't leave the rolled-back users in the cache
+            caching.invalidate_all()
+
+        if len(set(counts.values())) > 1:
+            raise CommandError('get_users query count grows with the number of users')
+        self.stdout.write(self.style.SUCCESS('Query counts are constant'))
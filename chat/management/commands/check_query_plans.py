@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from chat.benchmarks import full_scans, hot_queries
+from chat.models import Message
+
+
+class Command(BaseCommand):
+    help = 'Check with EXPLAIN that the hot chat queries use an index (SQLite only)'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Query plan checks are written for SQLite')
+
+        table = Message._meta.db_table
+        failures = []
+        for name, queryset in hot_queries(1, 2).items():
+            plan = queryset.explain()
+            scans = full_scans(plan, table)
+            if scans:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f'{name}: full table scan'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{name}: ok'))
+            if options['verbosity'] > 1 or scans:
+                self.stdout.write(plan)
+
+        if failures:
+            raise CommandError(f'{len(failures)} query(ies) scan {table}: {", ".join(failures)}')
@@ -0,0 +1,60 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import export
+
+
+class Command(BaseCommand):
+    help = 'Stream messages, archived ones included, to an NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-',
+                            help='File to write, or - for standard output')
+        parser.add_argument('--user',
+                            help='Only the messages this username sent or received')
+        parser.add_argument('--with', dest='other',
+                            help='Only the conversation between --user and this username')
+        parser.add_argument('--chunk-size', type=int, default=settings.EXPORT_CHUNK_SIZE,
+                            help='Rows read from the database at a time')
+
+    def handle(self, *args, **options):
+        if options['other'] and not options['user']:
+            raise CommandError('--with needs --user')
+        user = self.get_user(options['user'])
+        other = self.get_user(options['other'])
+
+        to_stdout = options['output'] == '-'
+        # The report must not end up in an export written to standard output
+        report = self.stderr if to_stdout else self.stdout
+
+        started = time.monotonic()
+        rows = 0
+        if to_stdout:
+            output = self.stdout
+            # Lines carry their own newline
+            output.ending = ''
+        else:
+            output = open(options['output'], 'w', encoding='utf-8')
+        try:
+            for line in export.export_lines(user, other, options['chunk_size']):
+                output.write(line)
+                rows += 1
+                if options['verbosity'] > 1 and rows % 100000 == 0:
+                    report.write(f'{rows} rows, {rows / (time.monotonic() - started):.0f} rows/s')
+        finally:
+            if not to_stdout:
+                output.close()
+
+        elapsed = time.monotonic() - started
+        report.write(f'Exported {rows} messages in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)')
+
+    def get_user(self, username):
+        if username is None:
+            return None
+        try:
+            return User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f'No user named {username}')
@@ -0,0 +1,238 @@
+import io
+import json
+import sys
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, reset_queries, transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from chat.conversations import ordered_pair, unread_count
+from chat.models import ArchivedMessage, Conversation, Message, UserStatus
+
+
+class Command(BaseCommand):
+    help = (
+        'Load messages from an NDJSON file written by export_messages. Messages keep '
+        'their exported ids unless another message already has them, and count as read. '
+        'Messages imported before are skipped, so a failed import can be run again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input',
+                            help='File to read, or - for standard input')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Messages per INSERT')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Messages per transaction')
+        parser.add_argument('--create-users', action='store_true',
+                            help='Create missing senders and receivers, without a usable password')
+        parser.add_argument('--no-backfill', action='store_true',
+                            help='Do not rebuild the conversation list afterwards')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--batch-size and --chunk-size must be at least 1')
+
+        self.create_users = options['create_users']
+        # username -> id, filled as new names show up
+        self.user_ids = {}
+        # (reader id, other user id) -> oldest message the reader had not
+        # read before the import, or None; watermarks never pass it
+        self.first_unread = {}
+        # (reader id, other user id) -> newest imported message id below that
+        self.newest = {}
+        self.duplicates = self.unknown = 0
+
+        started = time.monotonic()
+        imported = 0
+        source = sys.stdin if options['input'] == '-' else open(options['input'], encoding='utf-8')
+        try:
+            chunk = []
+            for number, line in enumerate(source, 1):
+                if not line.strip():
+                    continue
+                try:
+                    chunk.append(self.parse(line))
+                except ValueError as e:
+                    raise CommandError(f'Line {number}: {e} ({imported} messages were imported before it)')
+                if len(chunk) >= options['chunk_size']:
+                    imported += self.load(chunk, options['batch_size'])
+                    chunk = []
+                    if options['verbosity'] > 1:
+                        self.stdout.write(f'{imported} rows, {imported / (time.monotonic() - started):.0f} rows/s')
+            imported += self.load(chunk, options['batch_size'])
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'Imported {imported} messages in {elapsed:.1f}s ({imported / elapsed if elapsed else 0:.0f} rows/s)'
+        )
+        if self.duplicates:
+            self.stdout.write(f'Skipped {self.duplicates} messages that were already imported')
+        if self.unknown:
+            self.stdout.write(self.style.WARNING(
+                f'Skipped {self.unknown} messages from unknown users; pass --create-users to import them'
+            ))
+
+        if imported and not options['no_backfill']:
+            # bulk_create bypasses record_messages; rebuild the conversation rows in one pass
+            call_command('backfill_conversations', stdout=io.StringIO())
+        self.mark_read()
+
+    def parse(self, line):
+        row = json.loads(line)
+        if not isinstance(row, dict):
+            raise ValueError('not a JSON object')
+        missing = [field for field in ('sender', 'receiver', 'content', 'timestamp') if field not in row]
+        if missing:
+            raise ValueError(f'missing {", ".join(missing)}')
+        timestamp = parse_datetime(row['timestamp'])
+        if timestamp is None:
+            raise ValueError(f'invalid timestamp {row["timestamp"]!r}')
+        if settings.USE_TZ and timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp)
+        source_id = row.get('id')
+        return {
+            # Rows without a usable id get a new one
+            'id': source_id if type(source_id) is int and source_id > 0 else None,
+            'sender': row['sender'],
+            'receiver': row['receiver'],
+            'content': row['content'],
+            'is_bot_response': bool(row.get('is_bot_response', False)),
+            'timestamp': timestamp,
+        }
+
+    def load(self, rows, batch_size):
+        """
+        Insert one chunk of parsed rows in a single transaction. Returns
+        the number of messages inserted.
+        """
+        if not rows:
+            return 0
+        self.resolve_users({name for row in rows for name in (row['sender'], row['receiver'])})
+        known = [row for row in rows if row['sender'] in self.user_ids and row['receiver'] in self.user_ids]
+        self.unknown += len(rows) - len(known)
+
+        # Exported ids keep id order in step with timestamps; an id already
+        # taken, live or archived, is replaced by a new one. An id taken by
+        # the same message means it was imported before.
+        source_ids = [row['id'] for row in known if row['id'] is not None]
+        fields = ('id', 'sender_id', 'receiver_id', 'timestamp')
+        taken = {
+            row[0]: row[1:]
+            for model in (Message, ArchivedMessage)
+            for row in model.objects.filter(id__in=source_ids).values_list(*fields)
+        }
+        messages = []
+        for row in known:
+            sender_id, receiver_id = self.user_ids[row['sender']], self.user_ids[row['receiver']]
+            if taken.get(row['id']) == (sender_id, receiver_id, row['timestamp']):
+                self.duplicates += 1
+                continue
+            message_id = row['id'] if row['id'] not in taken else None
+            if message_id is not None:
+                taken[message_id] = (sender_id, receiver_id, row['timestamp'])
+            messages.append(Message(
+                id=message_id,
+                sender_id=sender_id,
+                receiver_id=receiver_id,
+                content=row['content'],
+                is_bot_response=row['is_bot_response'],
+                timestamp=row['timestamp'],
+            ))
+        if not messages:
+            return 0
+
+        self.find_first_unread({
+            (message.receiver_id, message.sender_id)
+            for message in messages
+            if message.sender_id != message.receiver_id
+        })
+        with transaction.atomic():
+            messages = Message.objects.bulk_create(messages, batch_size=batch_size)
+            # Move the id sequence past the kept ids (PostgreSQL; SQLite does it itself)
+            with connection.cursor() as cursor:
+                for statement in connection.ops.sequence_reset_sql(no_style(), [Message]):
+                    cursor.execute(statement)
+        for message in messages:
+            if message.sender_id != message.receiver_id:
+                key = (message.receiver_id, message.sender_id)
+                first_unread = self.first_unread[key]
+                if first_unread is None or message.id < first_unread:
+                    self.newest[key] = max(self.newest.get(key, 0), message.id)
+        # With DEBUG on, every INSERT would stay in the query log
+        reset_queries()
+        return len(messages)
+
+    def find_first_unread(self, keys):
+        """
+        Record, for conversations this import has not touched yet, the
+        oldest message each reader had not read. Runs before the chunk is
+        inserted, so every message found was there before the import.
+        """
+        keys = keys - self.first_unread.keys()
+        if not keys:
+            return
+        pairs = Q()
+        for reader_id, other_id in keys:
+            pair = ordered_pair(reader_id, other_id)
+            pairs |= Q(user_a_id=pair[0], user_b_id=pair[1])
+        conversations = {
+            (conversation.user_a_id, conversation.user_b_id): conversation
+            for conversation in Conversation.objects.filter(pairs)
+        }
+        for reader_id, other_id in keys:
+            pair = ordered_pair(reader_id, other_id)
+            conversation = conversations.get(pair)
+            watermark = 0
+            if conversation is not None:
+                watermark = conversation.last_read_a if reader_id == pair[0] else conversation.last_read_b
+            self.first_unread[(reader_id, other_id)] = Message.objects.filter(
+                sender_id=other_id, receiver_id=reader_id, id__gt=watermark
+            ).aggregate(first=Min('id'))['first']
+
+    def mark_read(self):
+        """
+        Move each participant's read watermark past the messages imported
+        into their conversations, so that history does not show up as
+        unread. Watermarks stop short of messages that were unread before
+        the import; imported messages above those stay unread too.
+        Conversations without a row (--no-backfill) are skipped.
+        """
+        with transaction.atomic():
+            for (reader_id, other_id), message_id in self.newest.items():
+                pair = ordered_pair(reader_id, other_id)
+                reader, other = ('a', 'b') if reader_id == pair[0] else ('b', 'a')
+                Conversation.objects.filter(
+                    user_a_id=pair[0], user_b_id=pair[1], **{f'last_read_{reader}__lt': message_id}
+                ).update(**{
+                    f'last_read_{reader}': message_id,
+                    f'unread_{reader}': unread_count(f'user_{reader}', f'user_{other}', message_id),
+                })
+
+    def resolve_users(self, usernames):
+        missing = usernames - self.user_ids.keys()
+        if not missing:
+            return
+        self.user_ids.update(User.objects.filter(username__in=missing).values_list('username', 'id'))
+
+        missing -= self.user_ids.keys()
+        if missing and self.create_users:
+            # Hash once; nobody can log in as an imported user until the password is reset
+            password = make_password(None)
+            with transaction.atomic():
+                User.objects.bulk_create(User(username=name, password=password) for name in missing)
+                created = dict(User.objects.filter(username__in=missing).values_list('username', 'id'))
+                # bulk_create skips the signal that gives every user a status row
+                UserStatus.objects.bulk_create(UserStatus(user_id=user_id) for user_id in created.values())
+            self.user_ids.update(created)
@@ -0,0 +1,101 @@
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+
+from chat.benchmarks import hot_queries, percentile
+from chat.conversations import record_message
+from chat.models import Message
+
+
+class Command(BaseCommand):
+    help = 'Run concurrent readers against a busy writer and report lock errors and read latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8,
+                            help='Reader threads running the hot chat queries')
+        parser.add_argument('--duration', type=float, default=5.0,
+                            help='Seconds to run')
+        parser.add_argument('--seed', type=int, default=500,
+                            help='Messages in the conversation before the run starts')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and connection.settings_dict['NAME'] in (':memory:', ''):
+            raise CommandError('The load test needs a database file shared between threads')
+
+        me = User.objects.create_user('load-test-reader')
+        other = User.objects.create_user('load-test-writer')
+        try:
+            self.run(me, other, options)
+        finally:
+            # Cascades to the users' messages and conversation
+            User.objects.filter(id__in=[me.id, other.id]).delete()
+
+    def run(self, me, other, options):
+        Message.objects.bulk_create(
+            Message(sender=other, receiver=me, content=f'seed {i}') for i in range(options['seed'])
+        )
+        journal_mode = 'n/a'
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                journal_mode = cursor.fetchone()[0]
+
+        stop = threading.Event()
+        lock = threading.Lock()
+        latencies = []
+        errors = {'read': 0, 'write': 0}
+        writes = [0]
+
+        def reader():
+            try:
+                while not stop.is_set():
+                    for queryset in hot_queries(me.id, other.id).values():
+                        started = time.perf_counter()
+                        try:
+                            list(queryset)
+                        except OperationalError:
+                            with lock:
+                                errors['read'] += 1
+                            continue
+                        with lock:
+                            latencies.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+
+        def writer():
+            try:
+                while not stop.is_set():
+                    try:
+                        with transaction.atomic():
+                            record_message(Message.objects.create(sender=other, receiver=me, content='load'))
+                    except OperationalError:
+                        errors['write'] += 1
+                        continue
+                    writes[0] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer)]
+        threads += [threading.Thread(target=reader) for _ in range(options['readers'])]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        time.sleep(options['duration'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(f'{connection.vendor} journal_mode={journal_mode}, {options["readers"]} readers, 1 writer, {elapsed:.1f}s')
+        self.stdout.write(f'reads: {len(latencies)} ({len(latencies) / elapsed:.0f}/s), '
+                          f'p50 {percentile(latencies, 0.5) * 1000:.2f} ms, '
+                          f'p99 {percentile(latencies, 0.99) * 1000:.2f} ms')
+        self.stdout.write(f'writes: {writes[0]} ({writes[0] / elapsed:.0f}/s)')
+        self.stdout.write(f'lock errors: {errors["read"]} read, {errors["write"]} write')
+
+        if errors['read'] or errors['write']:
+            raise CommandError('Queries failed with database lock errors')
+        self.stdout.write(self.style.SUCCESS('No lock errors'))
@@ -0,0 +1,152 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from chat import bot_queue, metrics, ratelimit
+from chat.ai_utils import TRANSFORMERS_AVAILABLE
+
+
+def _run_in_thread(jobs):
+    # Worker threads open their own database connections
+    close_old_connections()
+    try:
+        with metrics.timed('bot_batch'):
+            return bot_queue.run_batch(jobs)
+    finally:
+        close_old_connections()
+
+
+# Seconds between rewrites of --metrics-file
+METRICS_FILE_INTERVAL = 15
+# Seconds between sweeps for jobs left running by a worker that died
+STALE_JOBS_INTERVAL = 15
+
+
+def write_metrics(path):
+    # Replace the file in one step so a collector never reads half of it
+    with open(f'{path}.tmp', 'w') as f:
+        f.write(metrics.render())
+    os.replace(f'{path}.tmp', path)
+
+
+class Command(BaseCommand):
+    help = 'Process queued AI bot replies outside the web request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.BOT_WORKER_CONCURRENCY,
+                            help='Number of batches generated at the same time')
+        parser.add_argument('--batch-size', type=int, default=settings.BOT_BATCH_MAX_SIZE,
+                            help='Maximum number of replies generated in one model call')
+        parser.add_argument('--batch-window', type=float, default=settings.BOT_BATCH_WINDOW,
+                            help='Seconds to wait for a batch to fill up')
+        parser.add_argument('--max-attempts', type=int, default=settings.BOT_WORKER_MAX_ATTEMPTS,
+                            help='Give up on a job after this many failed attempts')
+        parser.add_argument('--timeout', type=float, default=settings.BOT_WORKER_JOB_TIMEOUT,
+                            help='Seconds a single batch may run before its jobs are retried')
+        parser.add_argument('--poll-interval', type=float, default=settings.BOT_WORKER_POLL_INTERVAL,
+                            help='Seconds to wait between polls when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is drained instead of polling forever')
+        parser.add_argument('--metrics-file',
+                            help='Write Prometheus metrics (model timings) to this file for a textfile collector')
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        batch_size = max(1, options['batch_size'])
+        batch_window = options['batch_window']
+        max_attempts = options['max_attempts']
+        timeout = options['timeout']
+        poll_interval = options['poll_interval']
+        metrics_file = options['metrics_file']
+        metrics_written = time.monotonic()
+
+        if not TRANSFORMERS_AVAILABLE:
+            self.stderr.write('Transformers is not installed; queued jobs will complete without a reply')
+
+        self.requeue_stale_jobs(timeout, max_attempts)
+        stale_checked = time.monotonic()
+        self.stdout.write(
+            f'Bot worker started (concurrency={concurrency}, batch_size={batch_size}, timeout={timeout}s)'
+        )
+
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bot-worker')
+        # Shared with every other worker through the database
+        slots = ratelimit.GenerationSlots(settings.BOT_MAX_INFLIGHT_GENERATIONS, settings.BOT_GENERATION_SLOT_TTL)
+        slots_refreshed = time.monotonic()
+        # future -> (jobs, start time, generation slot)
+        in_flight = {}
+        # Timed-out futures still hold a thread and their slot until generate() returns
+        abandoned = {}
+
+        try:
+            while True:
+                now = time.monotonic()
+                for future, (jobs, started, slot) in list(in_flight.items()):
+                    if future.done():
+                        del in_flight[future]
+                        slots.release(slot)
+                        self._finish(future, jobs, max_attempts)
+                    elif now - started > timeout:
+                        del in_flight[future]
+                        abandoned[future] = slot
+                        bot_queue.fail_jobs(jobs, f'Timed out after {timeout}s', max_attempts)
+                        self.stderr.write(f'Batch of {len(jobs)} job(s) timed out')
+                for future, slot in list(abandoned.items()):
+                    if future.done():
+                        del abandoned[future]
+                        slots.release(slot)
+
+                if now - slots_refreshed >= slots.ttl / 3:
+                    slots.refresh()
+                    slots_refreshed = now
+
+                # Sibling workers may die at any time, not only before this one starts
+                if now - stale_checked >= STALE_JOBS_INTERVAL:
+                    self.requeue_stale_jobs(timeout, max_attempts)
+                    stale_checked = now
+
+                if metrics_file and now - metrics_written >= METRICS_FILE_INTERVAL:
+                    write_metrics(metrics_file)
+                    metrics_written = now
+
+                jobs = []
+                # Idle polls only read; a slot is taken once there is work
+                if len(in_flight) + len(abandoned) < concurrency and bot_queue.has_due_jobs():
+                    # With every slot taken, due jobs wait in the queue
+                    slot = slots.acquire()
+                    if slot is not None:
+                        jobs = bot_queue.claim_batch(batch_size, batch_window)
+                        if not jobs:
+                            slots.release(slot)
+                if jobs:
+                    in_flight[executor.submit(_run_in_thread, jobs)] = (jobs, time.monotonic(), slot)
+                    continue
+
+                if options['once'] and not in_flight:
+                    break
+                time.sleep(poll_interval if not in_flight else min(poll_interval, 0.1))
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping bot worker')
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            slots.release_all()
+            if metrics_file:
+                write_metrics(metrics_file)
+
+    def requeue_stale_jobs(self, timeout, max_attempts):
+        requeued = bot_queue.requeue_stale_jobs(timeout, max_attempts)
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} stale job(s)')
+
+    def _finish(self, future, jobs, max_attempts):
+        try:
+            replies = future.result()
+        except Exception as e:
+            bot_queue.fail_jobs(jobs, e, max_attempts)
+            self.stderr.write(f'Batch of {len(jobs)} job(s) failed: {e}')
+            return
+        self.stdout.write(f'Batch of {len(jobs)} job(s) produced {len(replies)} reply(ies)')
@@ -0,0 +1,198 @@
+"""
+In-process performance metrics.
+
+PerformanceMiddleware (chat/middleware.py) tracks every request; code
+running inside it can add named spans with timed(), and database queries
+are counted by an execute wrapper installed on every connection. All of it
+is aggregated into histograms and counters held in memory and rendered in
+the Prometheus text format by render(). Each process keeps its own numbers.
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+from . import caching
+
+# Histogram upper bounds: seconds, and plain counts such as queries
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One count per bucket, plus +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+_lock = threading.Lock()
+# (name, labels) -> Histogram / counter value
+_histograms = {}
+_counters = defaultdict(float)
+
+
+def _labels(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def observe(name, value, buckets=DURATION_BUCKETS, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+
+def increment(name, amount=1, **labels):
+    with _lock:
+        _counters[(name, _labels(labels))] += amount
+
+
+class Timings:
+    """
+    What one request (or other unit of work) spent its time on
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.spans = defaultdict(float)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def chain(self):
+        # Nested trackers all see the work done inside the innermost one
+        timings = self
+        while timings is not None:
+            yield timings
+            timings = timings.parent
+
+
+_current = contextvars.ContextVar('chat_timings', default=None)
+
+
+@contextmanager
+def track():
+    """
+    Collect query counts and spans for the code run inside the block,
+    including code it hands to sync_to_async threads
+    """
+    timings = Timings(parent=_current.get())
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(name):
+    """
+    Time a block as the span `name` of the current request, and in the
+    chat_span_seconds histogram
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        timings = _current.get()
+        if timings is not None:
+            for tracked in timings.chain():
+                tracked.spans[name] += elapsed
+        observe('chat_span_seconds', elapsed, span=name)
+
+
+def _time_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        for tracked in timings.chain():
+            tracked.queries += 1
+            tracked.db_seconds += elapsed
+
+
+def install(connection, **kwargs):
+    """
+    connection_created receiver: time the queries run on this connection
+    """
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+def server_timing(timings):
+    """
+    Server-Timing header value for a finished request, in milliseconds
+    """
+    parts = [
+        f'total;dur={timings.elapsed() * 1000:.1f}',
+        f'db;dur={timings.db_seconds * 1000:.1f};desc="{timings.queries} queries"',
+    ]
+    parts += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.spans.items()]
+    return ', '.join(parts)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def render():
+    """
+    Every metric of this process in the Prometheus text exposition format,
+    including the chat cache hit/miss counters
+    """
+    with _lock:
+        counters = dict(_counters)
+        histograms = {
+            key: (histogram.buckets, list(histogram.counts), histogram.sum, histogram.count)
+            for key, histogram in _histograms.items()
+        }
+    for cache_name, counts in caching.stats().items():
+        for result in ('hits', 'misses'):
+            counters[('chat_cache_requests_total', _labels({'cache': cache_name, 'result': result}))] = counts[result]
+
+    lines = []
+    for metric_name in sorted({name for name, labels in counters}):
+        lines.append(f'# TYPE {metric_name} counter')
+        for (name, labels), value in sorted(counters.items()):
+            if name == metric_name:
+                lines.append(f'{name}{_format_labels(labels)} {value:g}')
+
+    for metric_name in sorted({name for name, labels in histograms}):
+        lines.append(f'# TYPE {metric_name} histogram')
+        for (name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+            if name != metric_name:
+                continue
+            cumulative = 0
+            for bound, bucket_count in zip([*buckets, '+Inf'], counts):
+                cumulative += bucket_count
+                le = bound if bound == '+Inf' else f'{bound:g}'
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total:g}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
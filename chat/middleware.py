@@ -0,0 +1,47 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+
+
+class PerformanceMiddleware:
+    """
+    Time every request: wall time, database queries and the spans recorded
+    with metrics.timed(). Results go to the in-memory histograms and, with
+    CHAT_SERVER_TIMING on, to a Server-Timing response header.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with metrics.track() as timings:
+            response = self.get_response(request)
+        self.record(request, response, timings)
+        return response
+
+    async def __acall__(self, request):
+        with metrics.track() as timings:
+            response = await self.get_response(request)
+        self.record(request, response, timings)
+        return response
+
+    def record(self, request, response, timings):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+
+        metrics.observe('chat_request_duration_seconds', timings.elapsed(), view=view)
+        metrics.observe('chat_request_db_seconds', timings.db_seconds, view=view)
+        metrics.observe('chat_request_queries', timings.queries, buckets=metrics.COUNT_BUCKETS, view=view)
+        metrics.increment('chat_requests_total', view=view, status=response.status_code)
+
+        if settings.CHAT_SERVER_TIMING:
+            response['Server-Timing'] = metrics.server_timing(timings)
@@ -0,0 +1,119 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:06
+
+from django.db import migrations, models
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+PREVIEW_LENGTH = 100
+
+
+def _newest_read(Message, reader, other):
+    return Coalesce(Subquery(
+        Message.objects.filter(sender=OuterRef(other), receiver=OuterRef(reader), is_read=True)
+        .order_by()
+        .values('receiver')
+        .annotate(newest=Max('id'))
+        .values('newest')
+    ), 0)
+
+
+def _unread(Message, reader, other, watermark):
+    return Coalesce(Subquery(
+        Message.objects.filter(sender=OuterRef(other), receiver=OuterRef(reader), id__gt=OuterRef(watermark))
+        .order_by()
+        .values('receiver')
+        .annotate(count=Count('id'))
+        .values('count')
+    ), 0)
+
+
+def conversations_from_messages(apps, schema_editor):
+    """
+    Create the Conversation rows of existing databases, which 0006 left
+    empty, so their watermarks can be seeded before is_read is dropped.
+    """
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+
+    # (user_a, user_b) -> newest message id in either direction
+    pairs = {}
+    directions = (
+        Message.objects.exclude(sender=F('receiver'))
+        .order_by()
+        .values('sender', 'receiver')
+        .annotate(last_id=Max('id'))
+    )
+    for row in directions.iterator():
+        pair = tuple(sorted((row['sender'], row['receiver'])))
+        pairs[pair] = max(pairs.get(pair, 0), row['last_id'])
+
+    items = list(pairs.items())
+    for start in range(0, len(items), 500):
+        batch = items[start:start + 500]
+        last_messages = Message.objects.in_bulk([last_id for pair, last_id in batch])
+        Conversation.objects.bulk_create([
+            Conversation(
+                user_a_id=user_a,
+                user_b_id=user_b,
+                last_message=last_messages[last_id],
+                last_message_preview=last_messages[last_id].content[:PREVIEW_LENGTH],
+                last_message_at=last_messages[last_id].timestamp,
+            )
+            for (user_a, user_b), last_id in batch
+        ], ignore_conflicts=True)
+
+
+def watermarks_from_flags(apps, schema_editor):
+    """Start each watermark at the newest message its reader had marked read."""
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+    Conversation.objects.update(
+        last_read_a=_newest_read(Message, 'user_a', 'user_b'),
+        last_read_b=_newest_read(Message, 'user_b', 'user_a'),
+    )
+    # Unread counters follow from the watermarks
+    Conversation.objects.update(
+        unread_a=_unread(Message, 'user_a', 'user_b', 'last_read_a'),
+        unread_b=_unread(Message, 'user_b', 'user_a', 'last_read_b'),
+    )
+
+
+def flags_from_watermarks(apps, schema_editor):
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+    for conversation in Conversation.objects.iterator():
+        for reader, other, last_read in (
+            (conversation.user_a_id, conversation.user_b_id, conversation.last_read_a),
+            (conversation.user_b_id, conversation.user_a_id, conversation.last_read_b),
+        ):
+            Message.objects.filter(sender=other, receiver=reader, id__lte=last_read).update(is_read=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_conversation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_read_a',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_read_b',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(conversations_from_messages, migrations.RunPython.noop),
+        migrations.RunPython(watermarks_from_flags, flags_from_watermarks),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='chat_msg_unread_idx',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:15
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_read_watermarks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedBotReply',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=200)),
+                ('prompt', models.CharField(max_length=255)),
+                ('reply', models.TextField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='chat_cachedreply_created_idx')],
+                'constraints': [models.UniqueConstraint(fields=('model_name', 'prompt'), name='chat_cachedreply_key_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:02
+
+from django.db import migrations
+
+# Frozen copies of the statements in chat/search.py as of this migration;
+# edits to that module must not change what this migration does.
+SQLITE_CREATE = [
+    # External content table: the index stores no copy of the text
+    "CREATE VIRTUAL TABLE chat_message_fts USING fts5(content, content='chat_message', "
+    "content_rowid='id', tokenize='porter unicode61 remove_diacritics 2')",
+    'CREATE TRIGGER IF NOT EXISTS chat_message_fts_insert AFTER INSERT ON chat_message BEGIN '
+    'INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content); END',
+    'CREATE TRIGGER IF NOT EXISTS chat_message_fts_delete AFTER DELETE ON chat_message BEGIN '
+    "INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    'CREATE TRIGGER IF NOT EXISTS chat_message_fts_update AFTER UPDATE OF content ON chat_message BEGIN '
+    "INSERT INTO chat_message_fts(chat_message_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    'INSERT INTO chat_message_fts(rowid, content) VALUES (new.id, new.content); END',
+    "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS chat_message_fts_insert',
+    'DROP TRIGGER IF EXISTS chat_message_fts_delete',
+    'DROP TRIGGER IF EXISTS chat_message_fts_update',
+    'DROP TABLE IF EXISTS chat_message_fts',
+]
+
+# The expression SearchVector('content', config='english') compiles to, so
+# the planner uses the index for the search queries
+POSTGRESQL_CREATE = [
+    "CREATE INDEX chat_msg_content_fts_idx ON chat_message "
+    "USING gin (to_tsvector('english'::regconfig, COALESCE(content, '')))",
+]
+
+POSTGRESQL_DROP = [
+    'DROP INDEX IF EXISTS chat_msg_content_fts_idx',
+]
+
+
+def _run(schema_editor, statements):
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_CREATE, 'postgresql': POSTGRESQL_CREATE})
+
+
+def drop_search_index(apps, schema_editor):
+    _run(schema_editor, {'sqlite': SQLITE_DROP, 'postgresql': POSTGRESQL_DROP})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_cachedbotreply'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
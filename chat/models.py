@@ -2,20 +2,73 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 
-class Message(models.Model):
-    sender = models.ForeignKey(User, related_name='sent_messages', on_delete=models.CASCADE)
-    receiver = models.ForeignKey(User, related_name='received_messages', on_delete=models.CASCADE)
+class MessageQuerySet(models.QuerySet):
+    def between(self, user, other):
+        """
+        Messages exchanged between two users, in either direction
+        """
+        return self.filter(
+            (models.Q(sender=user) & models.Q(receiver=other)) |
+            (models.Q(sender=other) & models.Q(receiver=user))
+        )
+
+class BaseMessage(models.Model):
+    """
+    Fields and behaviour shared by live and archived messages
+    """
     content = models.TextField()
     is_bot_response = models.BooleanField(default=False)
     timestamp = models.DateTimeField(default=timezone.now)
-    is_read = models.BooleanField(default=False)
+
+    objects = MessageQuerySet.as_manager()
 
     class Meta:
-        ordering = ['timestamp']
+        abstract = True
 
     def __str__(self):
         return f'{self.sender} to {self.receiver}: {self.content[:20]}...'
 
+    def to_dict(self, viewer_id):
+        """
+        JSON form of the message as seen by the given user
+        """
+        return {
+            'id': self.id,
+            'sender': self.sender.username,
+            'content': self.content,
+            'timestamp': self.timestamp.strftime('%H:%M'),
+            'is_bot_response': self.is_bot_response,
+            'is_self': self.sender_id == viewer_id,
+        }
+
+class Message(BaseMessage):
+    sender = models.ForeignKey(User, related_name='sent_messages', on_delete=models.CASCADE)
+    receiver = models.ForeignKey(User, related_name='received_messages', on_delete=models.CASCADE)
+
+    class Meta:
+        ordering = ['timestamp']
+        indexes = [
+            # Conversation history, newest message lookups and keyset pages
+            models.Index(fields=['sender', 'receiver', 'timestamp'], name='chat_msg_pair_ts_idx'),
+        ]
+
+class ArchivedMessage(BaseMessage):
+    """
+    A message moved out of Message once older than the retention horizon
+    (see chat/archive.py). It keeps its original id, so history cursors
+    still point at it.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    sender = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    receiver = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['sender', 'receiver', 'timestamp'], name='chat_archmsg_pair_ts_idx'),
+        ]
+
 class UserStatus(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     is_online = models.BooleanField(default=False)
@@ -24,3 +77,138 @@ class UserStatus(models.Model):
 
     def __str__(self):
         return f'{self.user.username} - {"Online" if self.is_online else "Offline"}'
+
+class BotReplyJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    # The message the bot should answer; the bot replies on behalf of its receiver
+    message = models.ForeignKey(Message, related_name='bot_jobs', on_delete=models.CASCADE)
+    reply = models.ForeignKey(Message, related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='chat_botjob_status_run_idx'),
+        ]
+
+    def __str__(self):
+        return f'Bot reply to message {self.message_id} ({self.status})'
+
+class BotGenerationSlot(models.Model):
+    """
+    One of the BOT_MAX_INFLIGHT_GENERATIONS slots a bot worker holds while
+    it generates (see chat/ratelimit.py)
+    """
+    number = models.PositiveIntegerField(primary_key=True)
+    # Token of the worker holding the slot; empty while it is free
+    holder = models.CharField(max_length=32, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'Generation slot {self.number} ({"taken" if self.holder else "free"})'
+
+class ConversationQuerySet(models.QuerySet):
+    def for_user(self, user):
+        return self.filter(models.Q(user_a=user) | models.Q(user_b=user))
+
+class Conversation(models.Model):
+    """
+    One row per pair of users who have exchanged messages, kept up to date
+    as messages are sent and read so that lists never scan Message.
+    The pair is stored with user_a.id < user_b.id.
+
+    Read state is a watermark per participant: the id of the newest message
+    they have read. Everything from the other participant above it is unread.
+    """
+    user_a = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    user_b = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    last_message = models.ForeignKey(Message, related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    last_message_preview = models.CharField(max_length=100, blank=True)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    # Newest message id each participant has read
+    last_read_a = models.PositiveBigIntegerField(default=0)
+    last_read_b = models.PositiveBigIntegerField(default=0)
+    # Messages each participant has not read yet, i.e. above their watermark
+    unread_a = models.PositiveIntegerField(default=0)
+    unread_b = models.PositiveIntegerField(default=0)
+
+    objects = ConversationQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_a', 'user_b'], name='chat_conversation_pair_uniq'),
+            models.CheckConstraint(condition=models.Q(user_a__lt=models.F('user_b')), name='chat_conversation_pair_order'),
+        ]
+        indexes = [
+            models.Index(fields=['user_b', '-last_message_at'], name='chat_conv_user_b_recent_idx'),
+            models.Index(fields=['user_a', '-last_message_at'], name='chat_conv_user_a_recent_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_a} and {self.user_b}'
+
+    def other_id(self, user_id):
+        return self.user_b_id if user_id == self.user_a_id else self.user_a_id
+
+    def unread_for(self, user_id):
+        return self.unread_a if user_id == self.user_a_id else self.unread_b
+
+    def last_read_for(self, user_id):
+        return self.last_read_a if user_id == self.user_a_id else self.last_read_b
+
+class CachedBotReply(models.Model):
+    """
+    Persisted entry of the bot reply cache (see chat/reply_cache.py)
+    """
+    # Model, backend and generation settings that produced the reply
+    model_name = models.CharField(max_length=200)
+    # Normalized prompt text
+    prompt = models.CharField(max_length=255)
+    reply = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['model_name', 'prompt'], name='chat_cachedreply_key_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='chat_cachedreply_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.prompt} -> {self.reply[:20]}'
+
+class ChatEvent(models.Model):
+    """
+    An event published through chat.events.DatabaseBroker, kept for a
+    short while so that every web process can pick it up
+    """
+    # Recipient's user id; null for events sent to everyone
+    user_id = models.IntegerField(null=True, blank=True)
+    payload = models.JSONField()
+    # Broker that published it, which has already delivered it itself
+    origin = models.CharField(max_length=32)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='chat_event_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.payload.get("type")} event for {self.user_id or "everyone"}'
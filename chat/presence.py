@@ -0,0 +1,122 @@
+"""
+Presence tracking with heartbeats.
+
+Clients send a heartbeat every PRESENCE_HEARTBEAT_INTERVAL seconds. The
+last-seen time lives in the cache with a PRESENCE_TTL expiry, so a user who
+closes the tab goes offline on their own once the entry expires. UserStatus
+is only a persisted copy, written in batches every PRESENCE_FLUSH_INTERVAL
+seconds. Deployments with several web processes need a shared cache backend.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import caching, events
+from .models import UserStatus
+
+KEY_PREFIX = 'presence:'
+
+_lock = threading.Lock()
+# user_id -> (is_online, last seen) waiting to be written to UserStatus
+_pending = {}
+_last_flush = time.monotonic()
+
+
+def _key(user_id):
+    return f'{KEY_PREFIX}{user_id}'
+
+
+def _broadcast(user_id, is_online):
+    caching.invalidate_presence()
+    events.broadcast({'type': 'presence', 'user': user_id, 'is_online': is_online})
+
+
+def heartbeat(user):
+    """
+    Record that the user is active right now
+    """
+    now = timezone.now()
+    was_online = cache.get(_key(user.id)) is not None
+    cache.set(_key(user.id), now.timestamp(), settings.PRESENCE_TTL)
+    with _lock:
+        _pending[user.id] = (True, now)
+    if not was_online:
+        _broadcast(user.id, True)
+    maybe_flush()
+
+
+def go_offline(user):
+    """
+    Take the user offline immediately, e.g. on logout
+    """
+    cache.delete(_key(user.id))
+    with _lock:
+        _pending[user.id] = (False, timezone.now())
+    _broadcast(user.id, False)
+    maybe_flush()
+
+
+def is_online(user_id):
+    return cache.get(_key(user_id)) is not None
+
+
+async def ais_online(user_id):
+    return await cache.aget(_key(user_id)) is not None
+
+
+def online_map(user_ids):
+    """
+    Online state for many users with a single cache read
+    """
+    user_ids = list(user_ids)
+    found = cache.get_many([_key(user_id) for user_id in user_ids])
+    return {user_id: _key(user_id) in found for user_id in user_ids}
+
+
+async def aonline_map(user_ids):
+    user_ids = list(user_ids)
+    found = await cache.aget_many([_key(user_id) for user_id in user_ids])
+    return {user_id: _key(user_id) in found for user_id in user_ids}
+
+
+def is_recently_seen(status):
+    """
+    Online check from the persisted UserStatus alone, for processes that
+    do not share the web servers' cache (such as the bot worker)
+    """
+    horizon = timedelta(seconds=settings.PRESENCE_TTL + settings.PRESENCE_FLUSH_INTERVAL)
+    return status.is_online and status.last_online >= timezone.now() - horizon
+
+
+def maybe_flush():
+    if time.monotonic() - _last_flush >= settings.PRESENCE_FLUSH_INTERVAL:
+        flush()
+
+
+def flush():
+    """
+    Write pending presence changes to UserStatus in one batch, and take
+    users whose heartbeat has expired offline
+    """
+    global _pending, _last_flush
+    with _lock:
+        pending, _pending = _pending, {}
+        _last_flush = time.monotonic()
+
+    if pending:
+        statuses = list(UserStatus.objects.filter(user_id__in=pending))
+        for status in statuses:
+            status.is_online, status.last_online = pending[status.user_id]
+        UserStatus.objects.bulk_update(statuses, ['is_online', 'last_online'])
+
+    persisted_online = list(UserStatus.objects.filter(is_online=True).values_list('user_id', flat=True))
+    alive = online_map(persisted_online)
+    expired = [user_id for user_id in persisted_online if not alive[user_id]]
+    if expired:
+        UserStatus.objects.filter(user_id__in=expired).update(is_online=False)
+        for user_id in expired:
+            _broadcast(user_id, False)
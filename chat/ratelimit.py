@@ -0,0 +1,157 @@
+"""
+Backpressure on the send path.
+
+Every message draws one token from a bucket of its sender and one of its
+receiver. Buckets refill continuously at SEND_RATE_* tokens per second up
+to SEND_BURST_* tokens, and live in the cache, so deployments with several
+web processes need a shared cache backend (see chat/presence.py). Buckets
+are read and written without a lock; concurrent requests may overspend one
+by a token, which is fine for throttling.
+
+Bot replies are protected further down the line: workers only generate
+while they hold one of BOT_MAX_INFLIGHT_GENERATIONS slots, and
+enqueue_bot_reply skips the reply once the queue is BOT_QUEUE_MAX_PENDING
+jobs deep.
+"""
+import math
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from . import metrics
+from .models import BotGenerationSlot
+
+KEY_PREFIX = 'ratelimit:'
+
+
+def _buckets(sender_id, receiver_id):
+    """
+    (name, cache key, rate, burst) of every bucket a message draws from
+    """
+    buckets = []
+    if settings.SEND_RATE_SENDER > 0:
+        buckets.append(('sender', f'{KEY_PREFIX}sender:{sender_id}',
+                        settings.SEND_RATE_SENDER, settings.SEND_BURST_SENDER))
+    if settings.SEND_RATE_RECEIVER > 0:
+        buckets.append(('receiver', f'{KEY_PREFIX}receiver:{receiver_id}',
+                        settings.SEND_RATE_RECEIVER, settings.SEND_BURST_RECEIVER))
+    return buckets
+
+
+def _take(buckets, states, now):
+    """
+    Take one token from every bucket, or from none of them. Returns the new
+    bucket states, the name of the first empty bucket (None if allowed) and
+    the seconds until it has a token again.
+    """
+    updates = {}
+    for name, key, rate, burst in buckets:
+        # (tokens, time they were counted); a missing bucket is full
+        tokens, counted_at = states.get(key) or (burst, now)
+        tokens = min(burst, tokens + (now - counted_at) * rate)
+        if tokens < 1:
+            return {}, name, (1 - tokens) / rate
+        updates[key] = (tokens - 1, now)
+    return updates, None, 0.0
+
+
+def _timeout(buckets):
+    # Once refilled a bucket is the same as a missing one
+    return math.ceil(max(burst / rate for name, key, rate, burst in buckets)) + 1
+
+
+def _decided(limited_by):
+    metrics.increment('chat_send_rate_limit_total', result=limited_by or 'allowed')
+
+
+def allow_send(sender_id, receiver_id):
+    """
+    Charge a message to its sender's and receiver's buckets. Returns
+    (None, 0) if it may be sent, or the name of the empty bucket and the
+    seconds to wait before retrying.
+    """
+    buckets = _buckets(sender_id, receiver_id)
+    if not buckets:
+        return None, 0.0
+    updates, limited_by, retry_after = _take(
+        buckets, cache.get_many([key for name, key, rate, burst in buckets]), time.time()
+    )
+    if updates:
+        cache.set_many(updates, _timeout(buckets))
+    _decided(limited_by)
+    return limited_by, retry_after
+
+
+async def aallow_send(sender_id, receiver_id):
+    buckets = _buckets(sender_id, receiver_id)
+    if not buckets:
+        return None, 0.0
+    updates, limited_by, retry_after = _take(
+        buckets, await cache.aget_many([key for name, key, rate, burst in buckets]), time.time()
+    )
+    if updates:
+        await cache.aset_many(updates, _timeout(buckets))
+    _decided(limited_by)
+    return limited_by, retry_after
+
+
+class GenerationSlots:
+    """
+    Cap on the bot generations running at once across every worker.
+
+    Each slot is a BotGenerationSlot row, taken with a conditional UPDATE
+    the way bot jobs are claimed, so workers in any number of processes
+    share the cap whatever the cache backend. A slot expires `ttl` seconds
+    after it was last refreshed, so slots held by a worker that died come
+    back on their own.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        # slot number -> token stored in it, which tells our slots apart
+        # from ones taken by someone else after an expiry
+        self._held = {}
+        BotGenerationSlot.objects.bulk_create(
+            [BotGenerationSlot(number=number) for number in range(size)], ignore_conflicts=True
+        )
+
+    def _expires_at(self):
+        return timezone.now() + timedelta(seconds=self.ttl)
+
+    def acquire(self):
+        """
+        Take a free slot. Returns its number, or None if all are taken.
+        """
+        free = Q(holder='') | Q(expires_at__lt=timezone.now())
+        candidates = BotGenerationSlot.objects.filter(free, number__lt=self.size).values_list('number', flat=True)
+        for number in list(candidates):
+            token = uuid.uuid4().hex
+            # Another worker may have taken it since it was read
+            if BotGenerationSlot.objects.filter(free, number=number).update(holder=token, expires_at=self._expires_at()):
+                self._held[number] = token
+                return number
+        metrics.increment('chat_bot_generation_slots_full_total')
+        return None
+
+    def refresh(self):
+        """
+        Keep every slot held by this process from expiring
+        """
+        if self._held:
+            BotGenerationSlot.objects.filter(holder__in=self._held.values()).update(expires_at=self._expires_at())
+
+    def release(self, number):
+        token = self._held.pop(number, None)
+        # Never free a slot that expired and was taken by someone else
+        if token is not None:
+            BotGenerationSlot.objects.filter(number=number, holder=token).update(holder='', expires_at=None)
+
+    def release_all(self):
+        for number in list(self._held):
+            self.release(number)
@@ -0,0 +1,113 @@
+"""
+WebSocket endpoint for real-time chat events, served by messenger/asgi.py.
+
+A logged-in browser opens /ws/ and receives the events published for its
+user (new messages, read receipts, bot replies, presence changes) as JSON
+text frames. Clients that cannot connect keep polling the JSON API.
+"""
+import asyncio
+import json
+from http.cookies import SimpleCookie
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import aget_user
+
+from . import events, presence
+
+WEBSOCKET_PATH = '/ws/'
+
+# Close codes from the application range (4000-4999)
+CLOSE_NOT_FOUND = 4404
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_FORBIDDEN = 4403
+
+
+class _SessionRequest:
+    """
+    Just enough of an HttpRequest for django.contrib.auth to read the session
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+
+def _headers(scope):
+    return {name.decode('latin-1'): value.decode('latin-1') for name, value in scope.get('headers', [])}
+
+
+def _same_origin(headers):
+    # Browsers always send Origin on WebSocket handshakes; refuse other sites
+    origin = headers.get('origin')
+    if origin is None:
+        return True
+    return urlsplit(origin).netloc == headers.get('host')
+
+
+async def authenticate(scope):
+    """
+    Return the user logged in with the session cookie of the handshake
+    """
+    cookies = SimpleCookie(_headers(scope).get('cookie', ''))
+    morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+    session_key = morsel.value if morsel else None
+
+    engine = import_module(settings.SESSION_ENGINE)
+    request = _SessionRequest(engine.SessionStore(session_key))
+    return await aget_user(request)
+
+
+async def websocket_application(scope, receive, send):
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+
+    if scope['path'] != WEBSOCKET_PATH:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+    if not _same_origin(_headers(scope)):
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+
+    user = await authenticate(scope)
+    if not user.is_authenticated:
+        await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+        return
+
+    await send({'type': 'websocket.accept'})
+
+    broker = events.get_broker()
+    subscription = broker.subscribe(user.id)
+    try:
+        await sync_to_async(presence.heartbeat)(user)
+        await _pump(user, subscription, receive, send)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def _pump(user, subscription, receive, send):
+    """
+    Forward published events to the socket until the client disconnects
+    """
+    receive_task = asyncio.ensure_future(receive())
+    event_task = asyncio.ensure_future(subscription.get())
+    try:
+        while True:
+            done, pending = await asyncio.wait(
+                {receive_task, event_task}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if receive_task in done:
+                message = receive_task.result()
+                if message['type'] == 'websocket.disconnect':
+                    return
+                # Anything the client sends is a keep-alive, which doubles as a heartbeat
+                await sync_to_async(presence.heartbeat)(user)
+                receive_task = asyncio.ensure_future(receive())
+            if event_task in done:
+                await send({'type': 'websocket.send', 'text': json.dumps(event_task.result())})
+                event_task = asyncio.ensure_future(subscription.get())
+    finally:
+        receive_task.cancel()
+        event_task.cancel()
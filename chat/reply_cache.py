@@ -0,0 +1,158 @@
+"""
+Cache of AI bot replies for short, repeated prompts ("hi", "ok", "are you there?").
+
+Prompts are normalized (case, whitespace, trailing punctuation) and keyed
+together with the model and the way it generates. Entries live in a bounded in-memory LRU with
+a TTL; with BOT_REPLY_CACHE_PERSIST they are also stored in the
+CachedBotReply table, so they survive worker restarts. A hit skips the
+tokenizer and generate() entirely.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics
+from .models import CachedBotReply
+
+
+def normalize(prompt):
+    return ' '.join(prompt.lower().split()).strip(' .!?')
+
+
+class ReplyCache:
+    """
+    Bounded LRU of (model key, normalized prompt) -> reply, with a TTL
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (reply, expiry on the monotonic clock)
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            reply, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return reply
+
+    def set(self, key, reply, ttl=None):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (reply, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                metrics.increment('chat_bot_reply_cache_evictions_total')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+cache = ReplyCache(settings.BOT_REPLY_CACHE_SIZE, settings.BOT_REPLY_CACHE_TTL)
+
+
+def model_key():
+    """
+    Identifies everything that changes the replies for a given prompt
+    """
+    return (
+        f'{settings.AI_BOT_MODEL_NAME}|{settings.AI_BOT_BACKEND.rsplit(".", 1)[-1]}'
+        f'|beams={settings.AI_BOT_NUM_BEAMS}|max_new_tokens={settings.AI_BOT_MAX_NEW_TOKENS}'
+    )
+
+
+def _key(prompt):
+    if len(prompt) > settings.BOT_REPLY_CACHE_MAX_PROMPT_LENGTH:
+        return None
+    return (model_key(), normalize(prompt))
+
+
+def _load(keys):
+    """
+    Persisted replies for the given keys that have not expired yet
+    """
+    oldest = timezone.now() - timedelta(seconds=settings.BOT_REPLY_CACHE_TTL)
+    model_name = model_key()
+    rows = CachedBotReply.objects.filter(
+        model_name=model_name,
+        prompt__in=[prompt for key_model_name, prompt in keys],
+        created_at__gte=oldest,
+    ).values_list('prompt', 'reply', 'created_at')
+    found = {}
+    for prompt, reply, created_at in rows:
+        key = (model_name, prompt)
+        found[key] = reply
+        # Keep it in memory only for the rest of its lifetime
+        cache.set(key, reply, (created_at - oldest).total_seconds())
+    return found
+
+
+def _store(replies):
+    now = timezone.now()
+    CachedBotReply.objects.bulk_create(
+        [
+            CachedBotReply(model_name=model_name, prompt=prompt, reply=reply, created_at=now)
+            for (model_name, prompt), reply in replies.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['model_name', 'prompt'],
+        update_fields=['reply', 'created_at'],
+    )
+    # Expired entries are evicted whenever new ones are stored
+    CachedBotReply.objects.filter(
+        created_at__lt=now - timedelta(seconds=settings.BOT_REPLY_CACHE_TTL)
+    ).delete()
+
+
+def generate_cached(prompts, generate):
+    """
+    One reply (or None) per prompt, like `generate`, which is only called
+    once, with the prompts missing from the cache. Repeated prompts within
+    the batch are generated once.
+    """
+    enabled = settings.BOT_REPLY_CACHE_SIZE > 0
+    # Cache key per prompt; prompts that are not cached get their index
+    slots = [(_key(prompt) if enabled else None) or i for i, prompt in enumerate(prompts)]
+    replies = [cache.get(slot) if isinstance(slot, tuple) else None for slot in slots]
+
+    missing = {slot for slot, reply in zip(slots, replies) if isinstance(slot, tuple) and reply is None}
+    persisted = _load(missing) if missing and settings.BOT_REPLY_CACHE_PERSIST else {}
+
+    # Prompts that still need the model, repeats only once
+    to_generate = {}
+    for i, slot in enumerate(slots):
+        if replies[i] is not None:
+            metrics.increment('chat_bot_reply_cache_total', source='memory')
+        elif slot in persisted:
+            replies[i] = persisted[slot]
+            metrics.increment('chat_bot_reply_cache_total', source='db')
+        else:
+            metrics.increment('chat_bot_reply_cache_total', source='model')
+            to_generate.setdefault(slot, prompts[i])
+
+    if to_generate:
+        generated = dict(zip(to_generate, generate(list(to_generate.values()))))
+        for i, slot in enumerate(slots):
+            if replies[i] is None:
+                replies[i] = generated[slot]
+
+        fresh = {slot: reply for slot, reply in generated.items() if isinstance(slot, tuple) and reply}
+        for key, reply in fresh.items():
+            cache.set(key, reply)
+        if fresh and settings.BOT_REPLY_CACHE_PERSIST:
+            _store(fresh)
+    return replies
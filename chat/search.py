@@ -0,0 +1,122 @@
+"""
+Full-text search over message content.
+
+On SQLite the index is an FTS5 table over chat_message, kept in sync by
+triggers on insert, update and delete, so bulk_create() and cascading
+deletes are indexed too. On PostgreSQL it is a GIN index on the message's
+tsvector, which the database maintains itself. Other databases fall back
+to LIKE scans.
+
+The index is created by migration 0009, which holds its own copy of the
+SQL. Later migrations that rebuild chat_message on SQLite drop its
+triggers; they are put back after every migrate by restore_triggers().
+"""
+import re
+
+from django.db import connection, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Message
+
+FTS_TABLE = 'chat_message_fts'
+# PostgreSQL text search configuration of the index and of the queries
+SEARCH_CONFIG = 'english'
+# Words of a query beyond this many are ignored
+MAX_TERMS = 10
+
+
+def _sqlite_triggers(table):
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON {table} BEGIN '
+        f'INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END',
+        f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON {table} BEGIN '
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); END",
+        f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF content ON {table} BEGIN '
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); "
+        f'INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END',
+    ]
+
+
+def _vector():
+    from django.contrib.postgres.search import SearchVector
+    return SearchVector('content', config=SEARCH_CONFIG)
+
+
+def restore_triggers(using, **kwargs):
+    """
+    post_migrate receiver: recreate the SQLite triggers if a table rebuild dropped them
+    """
+    db = connections[using]
+    if db.vendor != 'sqlite' or FTS_TABLE not in db.introspection.table_names():
+        return
+    with db.cursor() as cursor:
+        for statement in _sqlite_triggers(Message._meta.db_table):
+            cursor.execute(statement)
+
+
+def terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def _fts5_query(words):
+    # Every word quoted, so nothing the user types is read as FTS5 syntax
+    return ' '.join(f'"{word}"' for word in words)
+
+
+def _search_query(words):
+    from django.contrib.postgres.search import SearchQuery
+    return SearchQuery(' '.join(words), config=SEARCH_CONFIG, search_type='plain')
+
+
+def matches(query):
+    """
+    Filter for messages containing every word of `query`, answered by the
+    index. None when the query has no words.
+    """
+    words = terms(query)
+    if not words:
+        return None
+    if connection.vendor == 'sqlite':
+        return Q(id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [_fts5_query(words)]))
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchVectorExact
+        return Q(SearchVectorExact(_vector(), _search_query(words)))
+    return Q(*[Q(content__icontains=word) for word in words])
+
+
+def search_messages(user, query, page=1, page_size=20):
+    """
+    One page of the messages sent or received by `user` that contain every
+    word of `query`, best matches first and newest first among equals.
+    Returns (messages, has_next).
+    """
+    words = terms(query)
+    if not words:
+        return [], False
+    offset = (page - 1) * page_size
+    # One extra row tells whether there is a next page, without counting
+    limit = page_size + 1
+
+    if connection.vendor == 'sqlite':
+        table = Message._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT m.id FROM {FTS_TABLE} JOIN {table} m ON m.id = {FTS_TABLE}.rowid '
+                f'WHERE {FTS_TABLE} MATCH %s AND (m.sender_id = %s OR m.receiver_id = %s) '
+                f'ORDER BY {FTS_TABLE}.rank, m.id DESC LIMIT %s OFFSET %s',
+                [_fts5_query(words), user.id, user.id, limit, offset],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        found = Message.objects.select_related('sender', 'receiver').in_bulk(ids)
+        page_messages = [found[message_id] for message_id in ids if message_id in found]
+    else:
+        messages = Message.objects.filter(Q(sender=user) | Q(receiver=user), matches(query))
+        if connection.vendor == 'postgresql':
+            from django.contrib.postgres.search import SearchRank
+            messages = messages.annotate(rank=SearchRank(_vector(), _search_query(words))).order_by('-rank', '-id')
+        else:
+            messages = messages.order_by('-id')
+        page_messages = list(messages.select_related('sender', 'receiver')[offset:offset + limit])
+
+    return page_messages[:page_size], len(page_messages) > page_size
@@ -1,8 +1,8 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.contrib.auth.signals import user_logged_in, user_logged_out
-from django.utils import timezone
+from . import caching, presence
 from .models import UserStatus
 
 @receiver(post_save, sender=User)
@@ -10,17 +10,19 @@ def create_user_status(sender, instance, created, **kwargs):
     if created:
         UserStatus.objects.create(user=instance)
 
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_directory(sender, instance, update_fields=None, **kwargs):
+    # Logging in only touches last_login, which the directory doesn't hold
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    caching.invalidate_user_directory()
+
 @receiver(user_logged_in)
 def user_logged_in_handler(sender, request, user, **kwargs):
-    user_status, created = UserStatus.objects.get_or_create(user=user)
-    user_status.is_online = True
-    user_status.last_online = timezone.now()
-    user_status.save()
+    presence.heartbeat(user)
 
 @receiver(user_logged_out)
 def user_logged_out_handler(sender, request, user, **kwargs):
     if user:
-        user_status, created = UserStatus.objects.get_or_create(user=user)
-        user_status.is_online = False
-        user_status.last_online = timezone.now()
-        user_status.save() 
\ No newline at end of file
+        presence.go_offline(user)
@@ -0,0 +1,99 @@
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+
+from chat import search
+from chat.benchmarks import full_scans, hot_queries
+from chat.conversations import record_message
+from chat.models import Message
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plan checks are written for SQLite')
+class QueryPlanTests(TestCase):
+    def test_hot_queries_use_an_index(self):
+        table = Message._meta.db_table
+        for name, queryset in hot_queries(1, 2).items():
+            with self.subTest(name):
+                plan = queryset.explain()
+                self.assertEqual(full_scans(plan, table), [], plan)
+
+
+
+class QueryCountTests(TestCase):
+    def setUp(self):
+        self.me = User.objects.create_user('query-count-me')
+        self.client.force_login(self.me)
+
+    def add_users(self, count):
+        for i in range(count):
+            other = User.objects.create_user(f'query-count-{User.objects.count()}')
+            record_message(Message.objects.create(sender=other, receiver=self.me, content='unread'))
+
+    def test_get_users_runs_constant_queries(self):
+        for size in (5, 50):
+            self.add_users(size - User.objects.count() + 1)
+            # Measure the cold-cache cost
+            cache.clear()
+            # Session and user, the versions behind the ETag and the cache
+            # keys, the user list and the conversation summaries
+            with self.assertNumQueries(9):
+                response = self.client.get('/api/users/')
+            users = response.json()['users']
+            self.assertEqual(len(users), size)
+            self.assertTrue(all(user['unread_count'] == 1 for user in users))
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.carol = User.objects.create_user('carol')
+        self.client.force_login(self.alice)
+
+    def send(self, sender, receiver, content):
+        return Message.objects.create(sender=sender, receiver=receiver, content=content)
+
+    def found(self, user, query, **kwargs):
+        return [message.id for message in search.search_messages(user, query, **kwargs)[0]]
+
+    def test_results_contain_every_word(self):
+        both = self.send(self.alice, self.bob, 'Any dinner plans tonight?')
+        self.send(self.bob, self.alice, 'No plans yet')
+        self.send(self.bob, self.alice, 'Dinner was great')
+        self.assertEqual(self.found(self.alice, 'dinner plans'), [both.id])
+
+    def test_only_the_users_conversations_are_searched(self):
+        mine = self.send(self.bob, self.alice, 'dinner at eight')
+        self.send(self.bob, self.carol, 'dinner at nine')
+        response = self.client.get('/api/search/', {'q': 'dinner'})
+        results = response.json()['results']
+        self.assertEqual([result['id'] for result in results], [mine.id])
+        self.assertEqual(results[0]['conversation_with'], {'id': self.bob.id, 'username': 'bob'})
+
+    def test_index_follows_edits_and_deletes(self):
+        message = self.send(self.alice, self.bob, 'see you at lunch')
+        Message.objects.bulk_create([Message(sender=self.bob, receiver=self.alice, content='lunch is on me')])
+        self.assertEqual(len(self.found(self.alice, 'lunch')), 2)
+
+        message.content = 'see you at breakfast'
+        message.save()
+        self.assertEqual(self.found(self.alice, 'breakfast'), [message.id])
+        self.assertEqual(len(self.found(self.alice, 'lunch')), 1)
+
+        message.delete()
+        self.assertEqual(self.found(self.alice, 'breakfast'), [])
+
+    def test_pages(self):
+        for i in range(3):
+            self.send(self.alice, self.bob, f'weekend trip {i}')
+        results, has_next = search.search_messages(self.alice, 'trip', page=1, page_size=2)
+        self.assertEqual((len(results), has_next), (2, True))
+        results, has_next = search.search_messages(self.alice, 'trip', page=2, page_size=2)
+        self.assertEqual((len(results), has_next), (1, False))
+
+    def test_query_without_words_finds_nothing(self):
+        self.send(self.alice, self.bob, 'hello')
+        self.assertEqual(search.search_messages(self.alice, ' ?! '), ([], False))
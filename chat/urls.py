@@ -7,6 +7,12 @@ urlpatterns = [
     path('chat/<int:receiver_id>/', views.chat_view, name='chat'),
     path('api/messages/<int:receiver_id>/', views.get_messages, name='get_messages'),
     path('api/send_message/<int:receiver_id>/', views.send_message, name='send_message'),
+    path('api/search/', views.search_messages, name='search_messages'),
+    path('api/export/', views.export_messages, name='export_messages'),
     path('api/users/', views.get_users, name='get_users'),
     path('api/toggle_ai_bot/', views.toggle_ai_bot, name='toggle_ai_bot'),
+    path('api/events/', views.wait_for_events, name='wait_for_events'),
+    path('api/heartbeat/', views.heartbeat, name='heartbeat'),
+    path('api/cache_stats/', views.cache_stats, name='cache_stats'),
+    path('metrics/', views.prometheus_metrics, name='metrics'),
 ]
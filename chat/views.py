@@ -1,20 +1,72 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Q
-from django.utils import timezone
+from django.db.models import Max, Q
+from django.conf import settings
+from django.db import transaction
+from asgiref.sync import sync_to_async
+import asyncio
+import hashlib
+import hmac
 import json
+import math
+from datetime import datetime, timezone as dt_timezone
+from functools import wraps
 
-from .models import Message, UserStatus
+from .models import ArchivedMessage, Message, UserStatus
+from . import caching, events, export, metrics, presence, ratelimit, search
 from .forms import MessageForm, SignUpForm
-from .ai_utils import create_bot_response
+from .bot_queue import aenqueue_bot_reply
+from .conversations import amark_seen, mark_seen, record_message
+
+def contacts(user):
+    """
+    Every other user with presence and conversation summary, most recently
+    active first. Served from the cache; see chat/caching.py.
+    """
+    return _contact_list(
+        user,
+        caching.user_directory(),
+        caching.conversation_summaries(user.id),
+        caching.presence_snapshot(presence.online_map),
+    )
+
+async def acontacts(user):
+    return _contact_list(
+        user,
+        await caching.auser_directory(),
+        await caching.aconversation_summaries(user.id),
+        await caching.apresence_snapshot(presence.aonline_map),
+    )
+
+def _contact_list(user, directory, summaries, online):
+    contact_list = []
+    for user_id, username in directory:
+        if user_id == user.id:
+            continue
+        summary = summaries.get(user_id, {})
+        contact_list.append({
+            'id': user_id,
+            'username': username,
+            'is_online': online.get(user_id, False),
+            'unread_count': summary.get('unread_count', 0),
+            'last_message_preview': summary.get('last_message_preview', ''),
+            'last_message_at': summary.get('last_message_at'),
+        })
+    
+    never = datetime.min.replace(tzinfo=dt_timezone.utc)
+    contact_list.sort(key=lambda contact: contact['last_message_at'] or never, reverse=True)
+    return contact_list
 
 @login_required
 def home(request):
-    users = User.objects.exclude(id=request.user.id)
-    return render(request, 'chat/home.html', {'users': users})
+    return render(request, 'chat/home.html', {'users': contacts(request.user)})
 
 def signup(request):
     if request.method == 'POST':
@@ -26,58 +78,220 @@ def signup(request):
         form = SignUpForm()
     return render(request, 'chat/signup.html', {'form': form})
 
+def _etag(*parts):
+    return hashlib.md5(':'.join(str(part) for part in parts).encode(), usedforsecurity=False).hexdigest()
+
+def async_condition(etag_func):
+    """
+    condition(etag_func=...) for async views: the ETag function is awaited,
+    so it can use the async cache API and request.auser()
+    """
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            etag = quote_etag(await etag_func(request, *args, **kwargs))
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                response.headers.setdefault('ETag', etag)
+            return response
+        return inner
+    return decorator
+
+def _int_param(request, name, default=0):
+    value = request.GET.get(name)
+    if value in (None, ''):
+        return default
+    return int(value)
+
+def _history_query(messages, limit, before):
+    if before is not None:
+        messages = messages.filter(
+            Q(timestamp__lt=before.timestamp) |
+            Q(timestamp=before.timestamp, id__lt=before.id)
+        )
+    return messages.select_related('sender').order_by('-timestamp', '-id')[:limit + 1]
+
+def history_page(messages, limit, before=None):
+    """
+    Keyset page of a conversation on (timestamp, id): the `limit` most recent
+    messages, or the `limit` messages just before the `before` message.
+    Returns the page in chronological order and whether older messages exist.
+    """
+    page = list(_history_query(messages, limit, before))
+    return page[:limit][::-1], len(page) > limit
+
+async def ahistory_page(messages, limit, before=None):
+    page = [message async for message in _history_query(messages, limit, before)]
+    return page[:limit][::-1], len(page) > limit
+
+def conversation_history(user, other, limit, before=None):
+    """
+    history_page of the conversation, continued into the archived messages
+    once the live ones run out. `before` may be a message or an archived one.
+    """
+    archived = ArchivedMessage.objects.between(user, other)
+    if isinstance(before, ArchivedMessage):
+        return history_page(archived, limit, before)
+    page, has_more = history_page(Message.objects.between(user, other), limit, before)
+    if has_more:
+        return page, True
+    # Everything archived is older than the live messages
+    older, has_more = history_page(archived, limit - len(page), page[0] if page else before)
+    return older + page, has_more
+
+async def aconversation_history(user, other, limit, before=None):
+    archived = ArchivedMessage.objects.between(user, other)
+    if isinstance(before, ArchivedMessage):
+        return await ahistory_page(archived, limit, before)
+    page, has_more = await ahistory_page(Message.objects.between(user, other), limit, before)
+    if has_more:
+        return page, True
+    older, has_more = await ahistory_page(archived, limit - len(page), page[0] if page else before)
+    return older + page, has_more
+
 @login_required
 def chat_view(request, receiver_id):
     receiver = get_object_or_404(User, id=receiver_id)
     form = MessageForm()
     
-    # Get messages between the two users
-    messages = Message.objects.filter(
-        (Q(sender=request.user) & Q(receiver=receiver)) | 
-        (Q(sender=receiver) & Q(receiver=request.user))
-    ).order_by('timestamp')
+    # Only render the most recent page; older history is loaded on scroll
+    page, has_more = conversation_history(request.user, receiver, settings.MESSAGE_PAGE_SIZE)
     
-    # Mark all messages from the receiver as read
-    unread_messages = messages.filter(sender=receiver, is_read=False)
-    unread_messages.update(is_read=True)
+    # Everything on the page from the receiver has now been read
+    mark_seen(request.user, receiver, page)
     
     return render(request, 'chat/chat.html', {
         'receiver': receiver,
+        'receiver_online': presence.is_online(receiver.id),
         'form': form,
-        'messages': messages,
+        'messages': page,
+        'has_more': has_more,
+        'first_message_id': page[0].id if page else 0,
+        'last_message_id': max((message.id for message in page), default=0),
     })
 
+async def messages_etag(request, receiver_id):
+    # One lookup of the pair's Conversation row; no message is read
+    user = await request.auser()
+    version = await caching.aconversation_version(user.id, receiver_id)
+    return _etag(version, user.id, request.GET.urlencode())
+
 @login_required
-def get_messages(request, receiver_id):
-    receiver = get_object_or_404(User, id=receiver_id)
+@cache_control(private=True, no_cache=True)
+@async_condition(etag_func=messages_etag)
+async def get_messages(request, receiver_id):
+    user = await request.auser()
+    receiver = await aget_object_or_404(User, id=receiver_id)
+    
+    try:
+        after_id = _int_param(request, 'after_id')
+        before_id = _int_param(request, 'before_id')
+        limit = _int_param(request, 'limit', settings.MESSAGE_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Cursors and limit must be integers'}, status=400)
+    limit = max(1, min(limit, settings.MESSAGE_PAGE_SIZE_MAX))
     
     # Get messages between the two users
-    messages = Message.objects.filter(
-        (Q(sender=request.user) & Q(receiver=receiver)) | 
-        (Q(sender=receiver) & Q(receiver=request.user))
-    ).order_by('timestamp')
+    messages = Message.objects.between(user, receiver)
+    
+    if after_id:
+        # Only send what the client hasn't seen yet
+        delta = messages.filter(id__gt=after_id).select_related('sender').order_by('id')[:limit + 1]
+        page = [message async for message in delta]
+        has_more = len(page) > limit
+        page = page[:limit]
+    elif before_id:
+        # Older history, one page at a time
+        before = await messages.filter(id=before_id).only('id', 'timestamp').afirst()
+        if before is None:
+            # The cursor may have been archived since the client got it
+            before = await ArchivedMessage.objects.between(user, receiver).filter(id=before_id).only('id', 'timestamp').afirst()
+        if before is None:
+            return JsonResponse({'status': 'error', 'message': 'Unknown before_id'}, status=400)
+        with metrics.timed('page'):
+            page, has_more = await aconversation_history(user, receiver, limit, before)
+    else:
+        with metrics.timed('page'):
+            page, has_more = await aconversation_history(user, receiver, limit)
     
-    # Mark messages as read
-    unread_messages = messages.filter(sender=receiver, is_read=False)
-    unread_messages.update(is_read=True)
+    # Advance the read watermark; a no-op when the page holds nothing new
+    await amark_seen(user, receiver, page)
     
     # Format messages for JSON response
-    message_list = []
-    for message in messages:
-        message_list.append({
-            'id': message.id,
-            'sender': message.sender.username,
-            'content': message.content,
-            'timestamp': message.timestamp.strftime('%H:%M'),
-            'is_bot_response': message.is_bot_response,
-            'is_self': message.sender == request.user,
-        })
+    message_list = [message.to_dict(user.id) for message in page]
+    
+    return JsonResponse({
+        'messages': message_list,
+        'next_cursor': max([after_id] + [message.id for message in page]),
+        'prev_cursor': page[0].id if page else None,
+        'has_more': has_more,
+    })
+
+def _search_result(message, viewer_id):
+    other = message.receiver if message.sender_id == viewer_id else message.sender
+    return dict(
+        message.to_dict(viewer_id),
+        date=message.timestamp.isoformat(),
+        conversation_with={'id': other.id, 'username': other.username},
+    )
+
+@login_required
+async def search_messages(request):
+    user = await request.auser()
+    query = request.GET.get('q', '')
+    
+    try:
+        page = _int_param(request, 'page', 1)
+        page_size = _int_param(request, 'page_size', settings.SEARCH_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'page and page_size must be integers'}, status=400)
+    page = max(1, page)
+    page_size = max(1, min(page_size, settings.SEARCH_PAGE_SIZE_MAX))
+    
+    # Only the user's own conversations are searched
+    with metrics.timed('search'):
+        results, has_next = await sync_to_async(search.search_messages)(user, query, page, page_size)
+    
+    return JsonResponse({
+        'results': [_search_result(message, user.id) for message in results],
+        'page': page,
+        'has_next': has_next,
+    })
+
+@login_required
+async def export_messages(request):
+    user = await request.auser()
+    
+    # Everything the user sent or received, or one conversation with ?with=<user id>
+    other = None
+    try:
+        other_id = _int_param(request, 'with')
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'with must be a user id'}, status=400)
+    if other_id:
+        other = await aget_object_or_404(User, id=other_id)
     
-    return JsonResponse({'messages': message_list})
+    # Rows are streamed as they are read, never held in memory together. The
+    # iterator must match the server: Django turns an async iterator served
+    # over WSGI (or a sync one over ASGI) into a list first.
+    lines = export.aexport_lines if isinstance(request, ASGIRequest) else export.export_lines
+    response = StreamingHttpResponse(
+        lines(user, other, settings.EXPORT_CHUNK_SIZE),
+        content_type='application/x-ndjson',
+    )
+    response['Content-Disposition'] = 'attachment; filename="messages.ndjson"'
+    return response
+
+def _save_message(message):
+    with transaction.atomic():
+        message.save()
+        record_message(message)
 
 @csrf_exempt
 @login_required
-def send_message(request, receiver_id):
+async def send_message(request, receiver_id):
     if request.method == 'POST':
         data = json.loads(request.body)
         content = data.get('content')
@@ -85,94 +299,159 @@ def send_message(request, receiver_id):
         if not content:
             return JsonResponse({'status': 'error', 'message': 'Message content is required'})
         
-        receiver = get_object_or_404(User, id=receiver_id)
+        user = await request.auser()
+        receiver = await aget_object_or_404(User, id=receiver_id)
+        
+        # Refused before anything is written when the sender or receiver is over their rate
+        limited_by, retry_after = await ratelimit.aallow_send(user.id, receiver.id)
+        if limited_by:
+            response = JsonResponse({'status': 'error', 'message': 'Too many messages, please slow down'}, status=429)
+            response['Retry-After'] = str(math.ceil(retry_after))
+            return response
         
         # Create and save the message
         message = Message(
-            sender=request.user,
+            sender=user,
             receiver=receiver,
             content=content
         )
-        message.save()
+        # Transactions are not available to async code yet
+        with metrics.timed('save'):
+            await sync_to_async(_save_message)(message)
         
         # Format response
-        message_data = {
-            'id': message.id,
-            'sender': message.sender.username,
-            'content': message.content,
-            'timestamp': message.timestamp.strftime('%H:%M'),
-            'is_self': True,
-            'is_bot_response': False,
-        }
+        message_data = message.to_dict(user.id)
         
         # Check if receiver is offline and has AI bot enabled
         try:
-            user_status = UserStatus.objects.get(user=receiver)
+            user_status = await UserStatus.objects.aget(user=receiver)
             
-            # Only generate AI response if user is offline AND has AI bot enabled
-            if not user_status.is_online and user_status.ai_bot_enabled:
-                bot_message = create_bot_response(request.user, receiver)
-                if bot_message:
-                    bot_message_data = {
-                        'id': bot_message.id,
-                        'sender': bot_message.sender.username,
-                        'content': bot_message.content,
-                        'timestamp': bot_message.timestamp.strftime('%H:%M'),
-                        'is_self': False,
-                        'is_bot_response': True,
-                    }
-                    return JsonResponse({
-                        'status': 'success', 
-                        'message': message_data,
-                        'bot_response': bot_message_data
-                    })
+            # Only queue an AI response if user is offline AND has AI bot enabled.
+            # The bot worker runs the model; clients receive the reply with the next fetch.
+            if not await presence.ais_online(receiver.id) and user_status.ai_bot_enabled:
+                # Under load the reply is skipped; the message itself is kept either way
+                job = await aenqueue_bot_reply(message)
+                return JsonResponse({
+                    'status': 'success',
+                    'message': message_data,
+                    'bot_reply_pending': job is not None,
+                })
         except UserStatus.DoesNotExist:
             # Create a user status for the receiver if it doesn't exist
-            UserStatus.objects.create(user=receiver, is_online=False, ai_bot_enabled=False)
+            await UserStatus.objects.acreate(user=receiver, is_online=False, ai_bot_enabled=False)
         
         return JsonResponse({'status': 'success', 'message': message_data})
     
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'})
 
+async def _latest_received_id(user):
+    result = await Message.objects.filter(receiver=user).aaggregate(latest=Max('id'))
+    return result['latest'] or 0
+
 @login_required
-def get_users(request):
-    users = User.objects.exclude(id=request.user.id)
-    user_list = []
+async def wait_for_events(request):
+    """
+    Long-poll fallback for clients without WebSockets: hold the request
+    until an event is published for the user or the timeout passes. Events
+    from other processes, such as bot replies, arrive through the broker
+    (see chat/events.py). Every poll counts as a presence heartbeat, so
+    polling clients send no separate ones.
     
-    for user in users:
+    `since` is the cursor returned by the previous poll. If a message
+    arrived between two polls, a 'resync' event is returned straight away.
+    """
+    try:
+        since = _int_param(request, 'since')
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'since must be an integer'}, status=400)
+    user = await request.auser()
+    await sync_to_async(presence.heartbeat)(user)
+    
+    broker = events.get_broker()
+    subscription = broker.subscribe(user.id)
+    try:
+        latest = await _latest_received_id(user)
+        if since and latest > since:
+            return JsonResponse({'events': [{'type': 'resync'}], 'cursor': latest})
+        
         try:
-            status = UserStatus.objects.get(user=user)
-            is_online = status.is_online
-        except UserStatus.DoesNotExist:
-            is_online = False
-            
-        # Count unread messages
-        unread_count = Message.objects.filter(
-            sender=user, 
-            receiver=request.user, 
-            is_read=False
-        ).count()
+            event = await asyncio.wait_for(subscription.get(), settings.CHAT_LONG_POLL_TIMEOUT)
+        except asyncio.TimeoutError:
+            return JsonResponse({'events': [], 'cursor': latest})
         
-        user_list.append({
-            'id': user.id,
-            'username': user.username,
-            'is_online': is_online,
-            'unread_count': unread_count
-        })
+        # Hand over anything else that is already queued
+        event_list = [event]
+        while not subscription.queue.empty():
+            event_list.append(subscription.queue.get_nowait())
+    finally:
+        broker.unsubscribe(subscription)
     
-    return JsonResponse({'users': user_list})
+    return JsonResponse({'events': event_list, 'cursor': await _latest_received_id(user)})
+
+@csrf_exempt
+@login_required
+def heartbeat(request):
+    if request.method == 'POST':
+        presence.heartbeat(request.user)
+        return JsonResponse({'status': 'success', 'interval': settings.PRESENCE_HEARTBEAT_INTERVAL})
+    
+    return JsonResponse({'status': 'error', 'message': 'Invalid request method'})
+
+async def users_etag(request):
+    user = await request.auser()
+    return _etag(await caching.ainbox_version(user.id), user.id)
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@async_condition(etag_func=users_etag)
+async def get_users(request):
+    # Served from the cache; when nothing has changed only the version aggregates run
+    user = await request.auser()
+    user_list = []
+    
+    with metrics.timed('contacts'):
+        contact_list = await acontacts(user)
+    for contact in contact_list:
+        last_message_at = contact['last_message_at']
+        user_list.append(dict(contact, last_message_at=last_message_at.isoformat() if last_message_at else None))
+    
+    return JsonResponse({
+        'users': user_list,
+        'unread_total': sum(contact['unread_count'] for contact in contact_list),
+    })
+
+@login_required
+def cache_stats(request):
+    # Staff only: hit/miss counters of this process
+    if not request.user.is_staff:
+        return JsonResponse({'status': 'error', 'message': 'Forbidden'}, status=403)
+    return JsonResponse({'caches': caching.stats()})
+
+def prometheus_metrics(request):
+    """
+    Metrics of this process in the Prometheus text format, for staff or a
+    scraper sending METRICS_TOKEN as a bearer token
+    """
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    allowed = (
+        (settings.METRICS_TOKEN and hmac.compare_digest(token, settings.METRICS_TOKEN))
+        or request.user.is_staff
+    )
+    if not allowed:
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4')
 
 @csrf_exempt
 @login_required
-def toggle_ai_bot(request):
+async def toggle_ai_bot(request):
     if request.method == 'POST':
         data = json.loads(request.body)
         enabled = data.get('enabled', False)
         
         try:
-            user_status, created = UserStatus.objects.get_or_create(user=request.user)
+            user_status, created = await UserStatus.objects.aget_or_create(user=await request.auser())
             user_status.ai_bot_enabled = enabled
-            user_status.save()
+            await user_status.asave(update_fields=['ai_bot_enabled'])
             return JsonResponse({'status': 'success', 'enabled': enabled})
         except Exception as e:
             return JsonResponse({'status': 'error', 'message': str(e)})
@@ -203,10 +482,8 @@ def force_logout(request, user_id):
     user = get_object_or_404(User, id=user_id)
     
     try:
-        user_status, created = UserStatus.objects.get_or_create(user=user)
-        user_status.is_online = False
-        user_status.last_online = timezone.now()
-        user_status.save()
+        presence.go_offline(user)
+        presence.flush()
         
         return redirect('active_sessions')
     except Exception as e:
@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so that its timings cover the rest of the stack
+    'chat.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,13 +77,77 @@ WSGI_APPLICATION = 'messenger.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# DATABASE_PROFILE picks one of the profiles below: 'sqlite' (default) or 'postgres'.
+
+# SQLite in WAL mode lets readers run alongside a writer. The PRAGMAs run on
+# every new connection; BEGIN IMMEDIATE takes the write lock up front so that
+# concurrent writers wait for the busy timeout instead of failing with
+# "database is locked" when a read transaction upgrades.
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', '5000')),  # milliseconds
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', str(128 * 1024 * 1024))),  # bytes
+}
+
+# PostgreSQL keeps connections open for DATABASE_CONN_MAX_AGE seconds, or
+# draws them from a psycopg pool (pip install "psycopg[pool]") when
+# DATABASE_POOL_MAX_SIZE is set. Django does not allow both at once.
+DATABASE_POOL_MAX_SIZE = int(os.environ.get('DATABASE_POOL_MAX_SIZE', '0'))
+
+DATABASE_PROFILES = {
+    'sqlite': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('DATABASE_NAME', BASE_DIR / 'db.sqlite3'),
+        'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', '60')),
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+            'transaction_mode': 'IMMEDIATE',
+        },
+    },
+    'postgres': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('DATABASE_NAME', 'messenger'),
+        'USER': os.environ.get('DATABASE_USER', 'messenger'),
+        'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+        'HOST': os.environ.get('DATABASE_HOST', 'localhost'),
+        'PORT': os.environ.get('DATABASE_PORT', '5432'),
+        'CONN_MAX_AGE': 0 if DATABASE_POOL_MAX_SIZE else int(os.environ.get('DATABASE_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'pool': {
+                'min_size': int(os.environ.get('DATABASE_POOL_MIN_SIZE', '2')),
+                'max_size': DATABASE_POOL_MAX_SIZE,
+                'timeout': int(os.environ.get('DATABASE_POOL_TIMEOUT', '10')),
+            },
+        } if DATABASE_POOL_MAX_SIZE else {},
+    },
+}
+
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite')
+
 DATABASES = {
+    'default': DATABASE_PROFILES[DATABASE_PROFILE],
+}
+
+
+# Cache
+# Local memory by default. Cached chat data is versioned by the database
+# (chat/caching.py), so the bot worker and other commands never serve it
+# stale, but presence and rate limits live in the cache itself: point
+# CACHE_BACKEND/CACHE_LOCATION at a shared backend (Redis, Memcached) when
+# running more than one web process.
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'messenger'),
     }
 }
 
+# Seconds cached user lists and conversation summaries may live; a newer
+# version replaces them as soon as the underlying rows change
+CHAT_CACHE_TIMEOUT = 300
+
 
 # Password validation - simplified for development
 AUTH_PASSWORD_VALIDATORS = [
@@ -120,6 +186,103 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Hugging Face API Key
 HUGGINGFACE_API_KEY = os.environ.get('HUGGINGFACE_API_KEY', '')
 
+# AI bot model, loaded once per process and shared between requests
+AI_BOT_MODEL_NAME = os.environ.get('AI_BOT_MODEL_NAME', 'facebook/blenderbot-400M-distill')
+AI_BOT_DEVICE = os.environ.get('AI_BOT_DEVICE', 'cpu')
+AI_BOT_NUM_THREADS = int(os.environ.get('AI_BOT_NUM_THREADS', '0'))  # 0 keeps the torch default
+AI_BOT_DTYPE = os.environ.get('AI_BOT_DTYPE', 'float32')
+# Inference backend: chat.ai_utils.TorchBackend, or chat.ai_utils.QuantizedCPUBackend
+# to quantize the Linear layers to int8 (CPU only; ignores AI_BOT_DTYPE)
+AI_BOT_BACKEND = os.environ.get('AI_BOT_BACKEND', 'chat.ai_utils.TorchBackend')
+AI_BOT_INTEROP_THREADS = int(os.environ.get('AI_BOT_INTEROP_THREADS', '0'))  # 0 keeps the torch default
+# Generation: beam width (1 is greedy search) and longest reply in tokens
+AI_BOT_NUM_BEAMS = int(os.environ.get('AI_BOT_NUM_BEAMS', '1'))
+AI_BOT_MAX_NEW_TOKENS = int(os.environ.get('AI_BOT_MAX_NEW_TOKENS', '60'))
+# Load the model at startup instead of on the first bot reply
+AI_BOT_PRELOAD = os.environ.get('AI_BOT_PRELOAD', 'False') == 'True'
+
+# Bot replies are generated by `manage.py run_bot_worker`, not in the web request
+BOT_WORKER_CONCURRENCY = int(os.environ.get('BOT_WORKER_CONCURRENCY', '1'))
+BOT_WORKER_MAX_ATTEMPTS = int(os.environ.get('BOT_WORKER_MAX_ATTEMPTS', '3'))
+BOT_WORKER_JOB_TIMEOUT = float(os.environ.get('BOT_WORKER_JOB_TIMEOUT', '60'))
+BOT_WORKER_POLL_INTERVAL = float(os.environ.get('BOT_WORKER_POLL_INTERVAL', '1.0'))
+# Pending replies are generated together, up to this many per model call
+BOT_BATCH_MAX_SIZE = int(os.environ.get('BOT_BATCH_MAX_SIZE', '8'))
+# Seconds the worker waits for more replies before running a partial batch
+BOT_BATCH_WINDOW = float(os.environ.get('BOT_BATCH_WINDOW', '0.05'))
+# Bot generations running at once across all workers, counted in the
+# database; a slot held by a worker that died frees itself after
+# BOT_GENERATION_SLOT_TTL seconds
+BOT_MAX_INFLIGHT_GENERATIONS = int(os.environ.get('BOT_MAX_INFLIGHT_GENERATIONS', '2'))
+BOT_GENERATION_SLOT_TTL = int(os.environ.get('BOT_GENERATION_SLOT_TTL', '60'))
+# New bot replies are skipped while this many are waiting in the queue
+BOT_QUEUE_MAX_PENDING = int(os.environ.get('BOT_QUEUE_MAX_PENDING', '200'))
+
+# Bot replies to short prompts are cached (see chat/reply_cache.py): up to
+# BOT_REPLY_CACHE_SIZE entries in memory (0 turns the cache off), each kept
+# for BOT_REPLY_CACHE_TTL seconds. Prompts longer than
+# BOT_REPLY_CACHE_MAX_PROMPT_LENGTH characters (at most 255) are not cached.
+# BOT_REPLY_CACHE_PERSIST also stores entries in the database.
+BOT_REPLY_CACHE_SIZE = int(os.environ.get('BOT_REPLY_CACHE_SIZE', '1000'))
+BOT_REPLY_CACHE_TTL = int(os.environ.get('BOT_REPLY_CACHE_TTL', str(24 * 60 * 60)))
+BOT_REPLY_CACHE_MAX_PROMPT_LENGTH = int(os.environ.get('BOT_REPLY_CACHE_MAX_PROMPT_LENGTH', '100'))
+BOT_REPLY_CACHE_PERSIST = os.environ.get('BOT_REPLY_CACHE_PERSIST', 'False') == 'True'
+
+# Real-time events pushed over WebSockets (see chat/events.py). The database
+# broker shares them between processes, so bot replies stored by the worker
+# reach every client within CHAT_EVENT_POLL_INTERVAL seconds; stored events
+# are deleted after CHAT_EVENT_RETENTION seconds. chat.events.InProcessBroker
+# keeps them inside the publishing process.
+CHAT_EVENT_BROKER = 'chat.events.DatabaseBroker'
+CHAT_EVENT_POLL_INTERVAL = 0.25
+CHAT_EVENT_RETENTION = 60
+# Seconds /api/events/ holds a long-poll request open when there are no events.
+# Each poll is also a presence heartbeat, so keep it below PRESENCE_TTL, and
+# below the idle timeout of any proxy in front of the app.
+CHAT_LONG_POLL_TIMEOUT = 50
+
+# Presence: clients send a heartbeat every PRESENCE_HEARTBEAT_INTERVAL seconds
+# and count as offline PRESENCE_TTL seconds after the last one. UserStatus is
+# written in batches every PRESENCE_FLUSH_INTERVAL seconds.
+PRESENCE_HEARTBEAT_INTERVAL = 30
+PRESENCE_TTL = 75
+PRESENCE_FLUSH_INTERVAL = 15
+
+# Request timings: Server-Timing headers (readable by any client, so off
+# unless DEBUG), and the bearer token Prometheus sends to scrape /metrics/
+CHAT_SERVER_TIMING = os.environ.get('CHAT_SERVER_TIMING', str(DEBUG)) == 'True'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Conversation history is loaded in pages of this many messages
+MESSAGE_PAGE_SIZE = 50
+MESSAGE_PAGE_SIZE_MAX = 200
+
+# archive_messages moves messages older than MESSAGE_RETENTION_DAYS to the
+# archive table, ARCHIVE_BATCH_SIZE per transaction with a pause in between
+MESSAGE_RETENTION_DAYS = int(os.environ.get('MESSAGE_RETENTION_DAYS', '365'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '500'))
+ARCHIVE_BATCH_PAUSE = float(os.environ.get('ARCHIVE_BATCH_PAUSE', '0.05'))
+
+# Exports read messages from the database this many rows at a time
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', '2000'))
+
+# Token buckets of send_message (chat/ratelimit.py): each sender may send
+# SEND_RATE_SENDER messages per second on average, in bursts of up to
+# SEND_BURST_SENDER, and each receiver may get SEND_RATE_RECEIVER. 0 turns a bucket off.
+SEND_RATE_SENDER = float(os.environ.get('SEND_RATE_SENDER', '1'))
+SEND_BURST_SENDER = int(os.environ.get('SEND_BURST_SENDER', '10'))
+SEND_RATE_RECEIVER = float(os.environ.get('SEND_RATE_RECEIVER', '3'))
+SEND_BURST_RECEIVER = int(os.environ.get('SEND_BURST_RECEIVER', '30'))
+
+# Message search results are returned in pages of this many
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_SIZE_MAX = 50
+
+# Read watermarks are written in batches, READ_FLUSH_INTERVAL seconds after
+# the first pending read or as soon as READ_FLUSH_MAX_PENDING have piled up
+READ_FLUSH_INTERVAL = float(os.environ.get('READ_FLUSH_INTERVAL', '2'))
+READ_FLUSH_MAX_PENDING = int(os.environ.get('READ_FLUSH_MAX_PENDING', '500'))
+
 # Login/Logout URLs
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
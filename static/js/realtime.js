@@ -0,0 +1,91 @@
+/* Real-time chat events.
+ *
+ * connectChatEvents({onEvent, onOpen}) opens the /ws/ WebSocket and calls
+ * onEvent with every event the server pushes. While the socket is
+ * unavailable it long-polls /api/events/ instead, so pages never need a
+ * polling timer of their own. onOpen is called whenever a connection is
+ * (re)established, to catch up on anything missed while disconnected.
+ *
+ * It also keeps the user online: a ping on the socket when it is open.
+ * Long polls count as heartbeats, so a POST to /api/heartbeat/ is only
+ * sent while neither is running. An idle page makes no HTTP requests with
+ * the socket open, and one per CHAT_LONG_POLL_TIMEOUT while long-polling.
+ */
+function connectChatEvents(handlers) {
+    let socket = null;
+    let socketOpen = false;
+    let polling = false;
+    let cursor = 0;
+    let retryDelay = 1000;
+    // The server tells us how often it expects a heartbeat
+    let heartbeatInterval = 30000;
+
+    function heartbeat() {
+        if (socketOpen) {
+            socket.send('ping');
+        } else if (!polling) {
+            $.ajax({
+                url: '/api/heartbeat/',
+                type: 'POST',
+                dataType: 'json',
+                success: function(data) {
+                    heartbeatInterval = data.interval * 1000;
+                }
+            });
+        }
+        setTimeout(heartbeat, heartbeatInterval);
+    }
+
+    function longPoll() {
+        if (socketOpen || polling) {
+            return;
+        }
+        polling = true;
+
+        $.ajax({
+            url: '/api/events/',
+            type: 'GET',
+            data: { since: cursor },
+            dataType: 'json',
+            timeout: 60000,
+            success: function(data) {
+                cursor = data.cursor;
+                data.events.forEach(handlers.onEvent);
+            },
+            complete: function(xhr, status) {
+                polling = false;
+                if (!socketOpen) {
+                    // Back off a little if the server is unreachable
+                    setTimeout(longPoll, status === 'success' ? 0 : 5000);
+                }
+            }
+        });
+    }
+
+    function connect() {
+        const scheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
+        socket = new WebSocket(`${scheme}://${window.location.host}/ws/`);
+
+        socket.onopen = function() {
+            socketOpen = true;
+            retryDelay = 1000;
+            handlers.onOpen();
+        };
+        socket.onmessage = function(e) {
+            handlers.onEvent(JSON.parse(e.data));
+        };
+        socket.onclose = function() {
+            socketOpen = false;
+            longPoll();
+            setTimeout(connect, retryDelay);
+            retryDelay = Math.min(retryDelay * 2, 60000);
+        };
+    }
+
+    if ('WebSocket' in window) {
+        connect();
+    } else {
+        longPoll();
+    }
+    heartbeat();
+}